@@ -0,0 +1,281 @@
+"""
+Benchmarks for rayveal.py on a generated corpus of decks, so changes to scanning, the cache or the handlers
+can be compared with earlier commits. `python3 benchmark.py --help` for the corpus and run options.
+
+Measures a cold build (nothing cached), a warm build (every code result cached, decks rebuilt), a no-op build
+(everything up to date), scanning and pre-rendering throughput, and the peak memory of each.
+Results are appended to a json lines file and compared with the last run of the same corpus.
+"""
+from typing import Final, Any, Callable
+from dataclasses import dataclass
+import subprocess
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import random
+import platform
+import tempfile
+import statistics
+import contextlib
+import tracemalloc
+import dataclasses
+
+import rayveal
+
+_HERE:Final = os.path.dirname(os.path.abspath(__file__))
+_DEFAULT_RESULTS:Final = "build/benchmarks.jsonl"
+
+# Stands in for a C++ compiler so the benchmarks run without a toolchain, and measure rayveal rather than the compiler.
+# Sources containing STUB_ERROR do not compile, "binaries" are scripts printing a line.
+_STUB_COMPILER:Final = r"""#!/bin/sh
+output="" object="" header="" status=0 files=""
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --version) echo "stub-c++ 1.0"; exit 0 ;;
+        -dumpmachine) echo "stub-linux"; exit 0 ;;
+        -o*) output="${1#-o}" ;;
+        -c) object=1 ;;
+        -x) header=1; shift ;;
+        -include) shift ;;
+        -*) ;;
+        *) files="$files $1" ;;
+    esac
+    shift
+done
+for file in $files; do
+    if grep -q STUB_ERROR "$file"; then echo "$file:1:1: error: STUB_ERROR" >&2; status=1; continue; fi
+    # like -c without -o, object files are written to the working directory
+    if [ -n "$object" ] && [ -z "$output" ]; then name=$(basename "$file"); : > "${name%.*}.o"; fi
+done
+[ $status -ne 0 ] && exit $status
+if [ -n "$output" ]; then
+    if [ -n "$object" ] || [ -n "$header" ]; then : > "$output"
+    else printf '#!/bin/sh\necho "stub run"\n' > "$output"; chmod +x "$output"; fi
+fi
+exit 0
+"""
+
+@dataclass
+class CorpusShape:
+    """
+    What each generated deck has, malformed blocks are skipped (with a warning) by the scanner
+    """
+    decks: int = 8
+    slides: int = 40
+    cpp_blocks: int = 12
+    python_blocks: int = 6
+    append_chain: int = 3
+    malformed: int = 2
+    seed: int = 0
+
+def _cpp_blocks(deck:int, shape:CorpusShape, rng:random.Random) -> list[str]:
+    """
+    Blocks that run first, then compile only ones, then no-main (which carries on to later blocks) and the append chain
+    """
+    blocks: list[str] = []
+    for index in range(shape.cpp_blocks):
+        value = rng.randrange(1000)
+        match index % 4:
+            case 0: blocks.append(f'```cpp\nint x{index} = {value};\nreturn x{index} - {value};\n```\n<!-- .element: wants="runs" -->')
+            case 1: blocks.append(f'```cpp\n#include <vector>\nint main() {{\n    std::vector<int> v({value});\n    return v.size() != {value};\n}}\n```\n<!-- .element: wants="run" -->')
+            case 2: blocks.append(f'```cpp\nconstexpr auto twice = [](int i) {{ return i * 2; }};\nstatic_assert(twice({value}) == {value * 2});\n```\n<!-- .element: wants="compiles" -->')
+            case _: blocks.append(f'```cpp\nint broken{index} = STUB_ERROR;\n```\n<!-- .element: wants="not-compiles" -->')
+    if shape.append_chain > 0:
+        blocks.append(f'```cpp\n#include <string>\n// deck {deck}\nint link0() {{ return 0; }}\n```\n<!-- .element: wants="compiles no-main" id="chain{deck}-0" -->')
+        for link in range(1, shape.append_chain):
+            blocks.append(f'```cpp\nint link{link}() {{ return link{link - 1}() + 1; }}\n```\n<!-- .element: wants="compiles append-chain{deck}-{link - 1}" id="chain{deck}-{link}" -->')
+        blocks.append(f'```cpp\nint main() {{ return link{shape.append_chain - 1}() != {shape.append_chain - 1}; }}\n```\n<!-- .element: wants="runs append-chain{deck}-{shape.append_chain - 1}" -->')
+    return blocks
+
+def _python_blocks(shape:CorpusShape, rng:random.Random) -> list[str]:
+    blocks: list[str] = []
+    for index in range(shape.python_blocks):
+        value = rng.randrange(1000)
+        if index % 3 == 2: blocks.append(f'```python\nraise ValueError({value})\n```\n<!-- .element: wants="errors" -->')
+        else: blocks.append(f'```python\nprint(sum(range({value})))\n```\n<!-- .element: wants="runs" -->')
+    return blocks
+
+_MALFORMED:Final = (
+    '```cpp\nint unbalanced = 0;\n```\n<!-- .element: wants="runs" id=unbalanced" -->',
+    '```\nno language given\n```\n<!-- .element: wants="runs" -->',
+    '```rust\nfn main() {}\n```\n<!-- .element: wants="runs" -->',
+)
+
+def generate_corpus(directory:str, shape:CorpusShape) -> list[str]:
+    """
+    Write shape.decks decks into directory, returns their file names
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(shape.seed)
+    file_names: list[str] = []
+    for deck in range(shape.decks):
+        # malformed blocks go first so they never end up in an append chain
+        code = [_MALFORMED[index % len(_MALFORMED)] for index in range(shape.malformed)]
+        code += _python_blocks(shape, rng) + _cpp_blocks(deck, shape, rng)
+        slides = [f"# Deck {deck}\n\nA generated deck for benchmarking"]
+        for slide in range(shape.slides):
+            body = [f"## Slide {slide}", "", f"Some *text* with `code` and a [link](https://example.com/{slide}).", "", "- a point", "- another point"]
+            # code is spread over the slides in order, which is the order append chains need
+            if code and (slide * len(code)) // shape.slides != ((slide + 1) * len(code)) // shape.slides: body += ["", code.pop(0)]
+            slides.append("\n".join(body))
+        slides += code
+        file_name = os.path.join(directory, f"deck{deck:03}.md")
+        with open(file_name, "w") as deck_file:
+            deck_file.write("\n\n---\n\n".join(slides) + "\n")
+        file_names.append(os.path.basename(file_name))
+    return file_names
+
+def _build(corpus:str, decks:list[str], extra:list[str], env:dict[str, str]) -> dict[str, Any]:
+    """
+    Run rayveal.py on the corpus in its own process, returns its wall time, peak memory and profiled phases
+    """
+    args = [sys.executable, os.path.join(_HERE, "rayveal.py"), *decks, "-t", os.path.join(_HERE, "TemplateSlides.html.in"),
+            "-r", "reveal.js/", "--profile", "--profile-file", "build/profile.json", *extra]
+    start = time.perf_counter()
+    process = subprocess.Popen(args, cwd=corpus, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    assert process.stderr is not None
+    errors = process.stderr.read()
+    # wait4 gives the resource usage of just this build
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0: raise RuntimeError(f"Build failed ({process.returncode}): {' '.join(args)}\n{errors.decode(errors='replace')}")
+    with open(os.path.join(corpus, "build", "profile.json")) as profile_file:
+        phases = json.load(profile_file)["otherData"]["phases"]
+    return {"seconds": seconds, "peak_rss_mib": usage.ru_maxrss / 1024, "phases": {name: totals["seconds"] for name, totals in phases.items()}}
+
+def _in_process(function:Callable[[], None], repeat:int) -> tuple[float, float]:
+    """
+    Best time of repeat calls and the peak memory (MiB) python allocated in one
+    """
+    times: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak / 1024**2
+
+def _summarise(runs:list[dict[str, Any]]) -> dict[str, Any]:
+    seconds = [run["seconds"] for run in runs]
+    phases: dict[str, float] = {}
+    for name in runs[0]["phases"]: phases[name] = statistics.median(run["phases"].get(name, 0.0) for run in runs)
+    return {"seconds": statistics.median(seconds), "best_seconds": min(seconds), "peak_rss_mib": max(run["peak_rss_mib"] for run in runs), "phases": phases}
+
+def run_benchmarks(corpus:str, shape:CorpusShape, *, repeat:int = 3, jobs:int = 1, stub:bool = True) -> dict[str, Any]:
+    decks = generate_corpus(corpus, shape)
+    env = dict(os.environ)
+    if stub:
+        stub_file_name = os.path.join(corpus, "stub-c++")
+        with open(stub_file_name, "w") as stub_file:
+            stub_file.write(_STUB_COMPILER)
+        os.chmod(stub_file_name, 0o755)
+        env["CXX"] = stub_file_name
+    extra = ["-j", str(jobs)]
+    def clean() -> None:
+        shutil.rmtree(os.path.join(corpus, "build"), ignore_errors=True)
+
+    cold: list[dict[str, Any]] = []
+    for _ in range(repeat):
+        clean()
+        cold.append(_build(corpus, decks, extra, env))
+    warm = [_build(corpus, decks, extra + ["--rebuild"], env) for _ in range(repeat)]
+    no_op = [_build(corpus, decks, extra, env) for _ in range(repeat)]
+
+    markdown = []
+    for deck in decks:
+        with open(os.path.join(corpus, deck)) as deck_file:
+            markdown.append((deck_file.read(), rayveal.MetaData({"filename": deck})))
+    size = sum(len(text) for text, _ in markdown)
+    def scan() -> None:
+        # malformed blocks are warned about every scan
+        with contextlib.redirect_stdout(io.StringIO()):
+            for text, meta in markdown: rayveal.collect_code_blocks(text, meta)
+    def render() -> None:
+        for text, _ in markdown: rayveal.render_slides(text)
+    scan_seconds, scan_peak = _in_process(scan, repeat)
+    render_seconds, render_peak = _in_process(render, repeat)
+    return {
+        "cold": _summarise(cold), "warm": _summarise(warm), "no_op": _summarise(no_op),
+        "scan": {"seconds": scan_seconds, "mib_per_second": size / 1024**2 / scan_seconds, "peak_mib": scan_peak},
+        "render": {"seconds": render_seconds, "mib_per_second": size / 1024**2 / render_seconds, "peak_mib": render_peak},
+        "corpus_mib": size / 1024**2,
+    }
+
+def _commit() -> str | None:
+    try:
+        commit = subprocess.run(("git", "rev-parse", "--short", "HEAD"), cwd=_HERE, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(("git", "status", "--porcelain", "--untracked-files=no"), cwd=_HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+def _flatten(results:dict[str, Any], prefix:str = "") -> dict[str, float]:
+    flat: dict[str, float] = {}
+    for name, value in results.items():
+        if isinstance(value, dict): flat.update(_flatten(value, f"{prefix}{name}."))
+        else: flat[prefix + name] = value
+    return flat
+
+def compare(previous:dict[str, Any], current:dict[str, Any]) -> None:
+    """
+    Print how each measurement changed since previous, throughput is better higher and everything else lower
+    """
+    before, after = _flatten(previous["results"]), _flatten(current["results"])
+    print(f"Compared with {previous.get('commit') or 'unknown commit'} ({previous['date']}):")
+    for name, value in after.items():
+        if name not in before or not before[name] or ".phases." in name: continue
+        change = (value - before[name]) / before[name] * 100
+        print(f"  {name:28} {before[name]:10.3f} -> {value:10.3f}  ({change:+.1f}%)")
+
+def main() -> None:
+    import argparse
+    arg_parser = argparse.ArgumentParser(prog="benchmark.py", description="Benchmark rayveal.py on generated decks and compare with earlier runs.", add_help=True)
+    defaults = CorpusShape()
+    arg_parser.add_argument("--decks", type=int, default=defaults.decks, help=f"Decks to generate. Defaults to {defaults.decks}")
+    arg_parser.add_argument("--slides", type=int, default=defaults.slides, help=f"Slides in each deck. Defaults to {defaults.slides}")
+    arg_parser.add_argument("--cpp", type=int, default=defaults.cpp_blocks, help=f"C++ blocks in each deck, not counting append chains. Defaults to {defaults.cpp_blocks}")
+    arg_parser.add_argument("--python", type=int, default=defaults.python_blocks, help=f"Python blocks in each deck. Defaults to {defaults.python_blocks}")
+    arg_parser.add_argument("--append-chain", type=int, default=defaults.append_chain, help=f"Blocks appending to each other in each deck, 0 for none. Defaults to {defaults.append_chain}")
+    arg_parser.add_argument("--malformed", type=int, default=defaults.malformed, help=f"Malformed blocks in each deck. Defaults to {defaults.malformed}")
+    arg_parser.add_argument("--seed", type=int, default=defaults.seed, help=f"Seed of the generated code. Defaults to {defaults.seed}")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Times each build is measured, the median is kept. Defaults to 3")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1, help="Passed on to rayveal.py. Defaults to 1")
+    arg_parser.add_argument("--real-compiler", action="store_true", help="Compile C++ with the real compiler (CXX or the one rayveal.py finds) instead of a stub")
+    arg_parser.add_argument("--corpus", type=str, default=None, help="Folder to generate the decks in and build them, defaults to a temporary folder")
+    arg_parser.add_argument("--results", type=str, default=_DEFAULT_RESULTS, help=f"json lines file results are appended to and compared with. Defaults to {_DEFAULT_RESULTS}")
+    args = arg_parser.parse_args()
+
+    shape = CorpusShape(args.decks, args.slides, args.cpp, args.python, args.append_chain, args.malformed, args.seed)
+    settings = {"corpus": dataclasses.asdict(shape), "repeat": args.repeat, "jobs": args.jobs, "stub": not args.real_compiler}
+    corpus = args.corpus if args.corpus is not None else tempfile.mkdtemp(prefix="rayveal-benchmark-")
+    try:
+        results = run_benchmarks(os.path.abspath(corpus), shape, repeat=max(args.repeat, 1), jobs=args.jobs, stub=not args.real_compiler)
+    finally:
+        if args.corpus is None: shutil.rmtree(corpus, ignore_errors=True)
+    record = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _commit(), "python": platform.python_version(), "machine": platform.node(), **settings, "results": results}
+    for name in ("cold", "warm", "no_op"):
+        print(f"{name:6} build {results[name]['seconds']:8.3f}s (best {results[name]['best_seconds']:.3f}s), peak {results[name]['peak_rss_mib']:.1f} MiB")
+    for name in ("scan", "render"):
+        print(f"{name:6}       {results[name]['seconds']:8.3f}s ({results[name]['mib_per_second']:.1f} MiB/s), peak {results[name]['peak_mib']:.2f} MiB")
+
+    previous = None
+    if os.path.isfile(args.results):
+        with open(args.results) as results_file:
+            for line in results_file:
+                entry = json.loads(line)
+                if all(entry.get(name) == value for name, value in settings.items()) and entry.get("machine") == record["machine"]: previous = entry
+    if previous is not None: compare(previous, record)
+    if os.path.dirname(args.results): os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as results_file:
+        results_file.write(json.dumps(record) + "\n")
+    print(f"Appended results to {args.results}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 
-from typing import Protocol, Callable, LiteralString, override, Final, Iterable, Any
+from typing import Protocol, Callable, LiteralString, override, Final, Iterable, Iterator, Any, IO
 from dataclasses import dataclass
 import subprocess
 from os import getenv as get_env
@@ -7,8 +7,25 @@ import os
 import re
 import traceback
 import base64
-import zlib
 import io
+import json
+import hashlib
+import shutil
+import threading
+import functools
+import time
+import math
+import sys
+import queue
+import atexit
+import dataclasses
+import contextlib
+import html.parser
+import gzip
+import urllib.parse
+import socket
+# limits of ran code are POSIX only
+if os.name == "posix": import resource
 
 # parse slides
 # if code block:
@@ -34,8 +51,9 @@ class CompileResult:
 class RunResult:
     run_output: str
     return_code: int
+    timed_out: bool = False
     @property
-    def runs(self): return self.return_code == 0
+    def runs(self): return self.return_code == 0 and not self.timed_out
 
 @dataclass
 class CodeResult:
@@ -50,6 +68,9 @@ class CodeResult:
     def runs(self) -> bool:
         if self.run_result is not None: return self.run_result.runs
         return False
+    @property
+    def timed_out(self) -> bool:
+        return self.run_result is not None and self.run_result.timed_out
 
 class RuntimeLanguage:
     def __init__(self, string:str) -> None:
@@ -80,27 +101,46 @@ class CompileExecFlags:
 
 class MetaData:
     data: dict[str, str] = {}
+    def __init__(self, data:dict[str, str]|None = None) -> None:
+        # each instance gets its own copy, blocks are handled out of order when running in parallel
+        self.data = dict(data) if data is not None else {}
     def __repr__(self) -> str:
         return self.data.__repr__()
 
 type Handler  = Callable[[str, CompileExecFlags|None, MetaData|None], CodeResult]
+# Sees every block of a language before any are handled, e.g. to share work between them
+type BuildPreparer = Callable[[list[CodeBlock]], None]
 type Language = LiteralString | RuntimeLanguage
 
 class CodeHandlerRegistry(Protocol):
     def handle_code(self, language:RuntimeLanguage, code:str,
                     flags: CompileExecFlags|None = None,
                     meta:MetaData| None = None) -> CodeResult: ...
-    def add_language(self, language: LiteralString, handler: Handler) -> "CodeHandlerRegistry": ...
+    def add_language(self, language: LiteralString, handler: Handler, *, prepare: BuildPreparer|None = None) -> "CodeHandlerRegistry": ...
+    def prepare_build(self, blocks:"list[CodeBlock]") -> None: ...
+    def can_handle(self, language:RuntimeLanguage) -> bool: ...
 
 class DefaultHandler(CodeHandlerRegistry):
     def __init__(self):
         self.registry: dict[RuntimeLanguage, Handler] = {}
+        self.preparers: dict[RuntimeLanguage, BuildPreparer] = {}
 
     @override
-    def add_language(self, language:LiteralString, handler:Handler) -> "DefaultHandler":
+    def add_language(self, language:LiteralString, handler:Handler, *, prepare: BuildPreparer|None = None) -> "DefaultHandler":
         self.registry.update({RuntimeLanguage(str(language)): handler})
+        if prepare is not None: self.preparers.update({RuntimeLanguage(str(language)): prepare})
         return self
 
+    @override
+    def prepare_build(self, blocks:"list[CodeBlock]") -> None:
+        for language, prepare in self.preparers.items():
+            language_blocks = [block for block in blocks if block.language == language]
+            if language_blocks: prepare(language_blocks)
+
+    @override
+    def can_handle(self, language:RuntimeLanguage) -> bool:
+        return language in self.registry
+
     @override
     def handle_code(self,
                     language: RuntimeLanguage,
@@ -153,7 +193,6 @@ def _get_cpp_compiler() -> str:
     if compiler_path := find_executable("clang++"): return compiler_path
     raise RuntimeError("could not find C++ compiler")
 
-_CPP_COMPILER:str = _get_cpp_compiler()
 
 def clean_link(link:str) -> str:
     import random
@@ -169,18 +208,484 @@ def clean_link(link:str) -> str:
         )
     return link
 
-def _create_unique_file_name(code:Code, meta:MetaData|None) -> str:
+@dataclass
+class ProfileSpan:
     """
-    create a unique file name
+    A timed part of the build, counts include what happened in the spans inside it
     """
-    
-    meta_data = "".join({a+b for a,b in meta.data.items()}) if meta is not None else ""
-    checksum = zlib.adler32((code+meta_data).encode("utf-8"))
-    b64_hash = base64.b64encode(checksum.to_bytes(4, signed=False)).decode("utf-8")
-    b64_hash = b64_hash.replace("=", "").replace("/", "").replace("+", "")
-    if meta is not None and "filename" in meta.data.keys(): return meta.data["filename"] + b64_hash
-    # use adler for speed and determinism
-    return b64_hash
+    name: str
+    start: float
+    thread: int
+    deck: str | None = None
+    block: int | None = None
+    # the outermost span of its deck on its thread, deck totals only add these up
+    top: bool = True
+    duration: float = 0.0
+    counts: dict[str, int] = dataclasses.field(default_factory=dict)
+
+class BuildProfiler:
+    """
+    Records how long each part of the build takes, per deck and code block, when enabled (--profile).
+    Counts (cache hits/misses, subprocesses) go to every span open on the thread that counts them,
+    deck totals add up those of the deck's blocks.
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.spans: list[ProfileSpan] = []
+        self._start = time.perf_counter()
+        self._open = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list[ProfileSpan]:
+        if not hasattr(self._open, "stack"): self._open.stack = []
+        return self._open.stack
+
+    @contextlib.contextmanager
+    def span(self, name:str, *, deck:str|None = None, block:int|None = None) -> Iterator[None]:
+        """
+        Time what is ran inside, deck and block default to those of the span this is in
+        """
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is not None:
+            deck = parent.deck if deck is None else deck
+            block = parent.block if block is None else block
+        top = parent is None or parent.deck != deck
+        span = ProfileSpan(name, time.perf_counter() - self._start, threading.get_ident(), deck, block, top)
+        stack.append(span)
+        try:
+            yield
+        finally:
+            span.duration = time.perf_counter() - self._start - span.start
+            stack.pop()
+            with self._lock:
+                self.spans.append(span)
+
+    def count(self, name:str, amount:int = 1) -> None:
+        if not self.enabled: return
+        for span in self._stack():
+            span.counts[name] = span.counts.get(name, 0) + amount
+
+    def summary(self) -> dict[str, Any]:
+        """
+        Totals per part of the build, per deck and per block, slowest first
+        """
+        def add(totals:dict[str, Any], span:ProfileSpan, *, seconds:bool = True, counts:bool = True) -> None:
+            if seconds: totals["seconds"] = totals.get("seconds", 0.0) + span.duration
+            if counts:
+                for name, amount in span.counts.items(): totals[name] = totals.get(name, 0) + amount
+        phases: dict[str, dict[str, Any]] = {}
+        decks: dict[str, dict[str, Any]] = {}
+        for span in self.spans:
+            add(phases.setdefault(span.name, {}), span)
+            if span.deck is None: continue
+            # blocks run on other threads than their deck, so a deck counts what its blocks counted
+            #  rather than what was counted on its own thread
+            add(decks.setdefault(span.deck, {"seconds": 0.0}), span, seconds=span.top, counts=span.name == "block")
+        blocks = [{"deck": span.deck, "line": span.block, "seconds": span.duration, **span.counts} for span in self.spans if span.name == "block"]
+        def slowest(totals:dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+            return dict(sorted(totals.items(), key=lambda item: -item[1]["seconds"]))
+        return {"phases": slowest(phases), "decks": slowest(decks), "blocks": sorted(blocks, key=lambda block: -block["seconds"])}
+
+    def report(self, file_name:str, *, top:int = 10) -> None:
+        """
+        Print the slowest parts, decks and blocks, and write every span to file_name as a Chrome trace (chrome://tracing, Perfetto)
+        """
+        summary = self.summary()
+        def counts(totals:dict[str, Any]) -> str:
+            return ", ".join(f"{totals[name]} {name}" for name in sorted(totals) if name not in {"seconds", "deck", "line"})
+        print("Profile (wall time, parts run in parallel overlap):")
+        for title, rows in (("Build", list(summary["phases"].items())), ("Decks", list(summary["decks"].items())[:top])):
+            print(f"  {title}:")
+            for name, totals in rows:
+                print(f"    {totals['seconds']:8.3f}s  {name}" + (f"  ({extra})" if (extra := counts(totals)) else ""))
+        print("  Slowest code blocks:")
+        for block in summary["blocks"][:top]:
+            print(f"    {block['seconds']:8.3f}s  {block['deck']} line {block['line']}" + (f"  ({extra})" if (extra := counts(block)) else ""))
+        def event(span:ProfileSpan) -> dict[str, Any]:
+            args = {"deck": span.deck, "block": span.block, **span.counts}
+            return {"name": span.name, "cat": "build", "ph": "X", "ts": round(span.start * 1e6), "dur": round(span.duration * 1e6),
+                    "pid": os.getpid(), "tid": span.thread, "args": {name: value for name, value in args.items() if value is not None}}
+        if os.path.dirname(file_name): os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, "w") as trace_file:
+            json.dump({"traceEvents": [event(span) for span in sorted(self.spans, key=lambda span: span.start)],
+                       "displayTimeUnit": "ms", "otherData": summary}, trace_file, indent=1)
+        print(f"Wrote profile to {file_name}")
+
+_PROFILER:Final = BuildProfiler()
+_DEFAULT_PROFILE:Final = "build/profile.json"
+
+def _code_result_from_json(data:dict[str, Any]) -> CodeResult:
+    compile_result = data.get("compile_result")
+    run_result = data.get("run_result")
+    return CodeResult(
+        compile_result=CompileResult(**compile_result) if compile_result is not None else None,
+        run_result=RunResult(**run_result) if run_result is not None else None,
+    )
+
+@dataclass
+class CacheStats:
+    entries: int
+    size: int
+    oldest_access: float | None
+    newest_access: float | None
+
+class ResultStore(Protocol):
+    """
+    Somewhere code results can be shared from, e.g. between machines. Values are a result as json, keys a ResultCache key.
+    """
+    def get(self, key:str) -> bytes | None: ...
+    def put(self, key:str, value:bytes) -> None: ...
+
+_STORE_KEY:Final = re.compile(r"[0-9a-f]{64}")
+
+class DirectoryResultStore(ResultStore):
+    """
+    Results as files in a (local or shared network) folder, written to a temporary file and renamed
+    so builds sharing it never read a half written result
+    """
+    def __init__(self, directory:str) -> None:
+        self.directory = directory
+
+    def _path(self, key:str) -> str:
+        if _STORE_KEY.fullmatch(key) is None: raise ValueError(f"Not a result key: {key}")
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    @override
+    def get(self, key:str) -> bytes | None:
+        try:
+            with open(self._path(key), "rb") as result_file:
+                return result_file.read()
+        except FileNotFoundError:
+            return None
+
+    @override
+    def put(self, key:str, value:bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique to this writer, other machines may be writing the same result
+        temp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as result_file:
+            result_file.write(value)
+        os.replace(temp_path, path)
+
+class HttpResultStore(ResultStore):
+    """
+    Results from a key/value server, GET and PUT of url/key. If the server cannot be reached the build carries on without it.
+    """
+    def __init__(self, url:str, *, timeout:float = 10.0) -> None:
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._unavailable = False
+
+    def _request(self, key:str, method:str, value:bytes|None = None) -> bytes | None:
+        import urllib.request, urllib.error
+        if self._unavailable or _STORE_KEY.fullmatch(key) is None: return None
+        request = urllib.request.Request(f"{self.url}/{key}", data=value, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 404: print(f"Warning: shared cache {self.url} answered {e.code} to {method} {key}")
+            return None
+        except OSError as e:
+            self._unavailable = True
+            print(f"Warning: shared cache {self.url} is unavailable ({e}), building without it")
+            return None
+
+    @override
+    def get(self, key:str) -> bytes | None:
+        return self._request(key, "GET")
+
+    @override
+    def put(self, key:str, value:bytes) -> None:
+        self._request(key, "PUT", value)
+
+def create_result_store(location:str) -> ResultStore:
+    """
+    A store for an http(s) url or a folder
+    """
+    if re.match(r"https?://", location): return HttpResultStore(location)
+    return DirectoryResultStore(location)
+
+_MAX_STORED_RESULT:Final = 16 * 1024**2
+
+def serve_result_store(store:ResultStore, port:int, *, host:str = "localhost") -> "http.server.ThreadingHTTPServer":
+    """
+    A key/value server for HttpResultStore, a stand-in for a real one that keeps results in store
+    """
+    import http.server
+
+    class ResultStoreHandler(http.server.BaseHTTPRequestHandler):
+        def _key(self) -> str | None:
+            key = self.path.strip("/")
+            if _STORE_KEY.fullmatch(key) is not None: return key
+            self.send_error(400, "Not a result key")
+            return None
+
+        def do_GET(self) -> None:
+            if (key := self._key()) is None: return
+            if (value := store.get(key)) is None: return self.send_error(404)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(value)))
+            self.end_headers()
+            self.wfile.write(value)
+
+        def do_PUT(self) -> None:
+            if (key := self._key()) is None: return
+            # the body is only read once its size is known to be fine
+            if (length_header := self.headers.get("Content-Length")) is None: return self.send_error(411)
+            try:
+                length = int(length_header)
+            except ValueError:
+                return self.send_error(400, "Invalid Content-Length")
+            if length < 0: return self.send_error(400, "Invalid Content-Length")
+            if length > _MAX_STORED_RESULT: return self.send_error(413)
+            store.put(key, self.rfile.read(length))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format:str, *args:Any) -> None:
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), ResultStoreHandler)
+    server.daemon_threads = True
+    return server
+
+class ResultCache:
+    """
+    Content addressed store of code results, kept in a json manifest next to the build artifacts.
+    Keys are a sha256 of everything that can change a result, see `create_key`.
+    Each entry records its artifacts, their size and when it was last used so `gc` can evict the least recently used.
+    Results missing here are looked for in the shared store (if any), and results put here are shared.
+    """
+    _MANIFEST_VERSION:Final = 2
+    _MANIFEST_NAME:Final = "manifest.json"
+    # seconds an unowned file is left alone, another build may be about to put it
+    _UNOWNED_GRACE:Final = 10 * 60
+
+    def __init__(self, directory:str = "build/cache") -> None:
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, self._MANIFEST_NAME)
+        self._entries: dict[str, dict[str, Any]] | None = None
+        # tools found on this machine, saves probing for them every run
+        self._discovered: dict[str, str] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self.shared: ResultStore | None = None
+
+    @staticmethod
+    def create_key(*parts:object) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path_for(self, key:str, suffix:str = "") -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, key + suffix)
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        if self._entries is not None: return self._entries
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get("version") != self._MANIFEST_VERSION: raise ValueError("Old manifest version")
+            self._entries = manifest["entries"]
+            self._discovered = manifest.get("discovered", {})
+        except (OSError, ValueError, KeyError):
+            self._entries = {}
+        return self._entries
+
+    def discovered(self, name:str) -> str | None:
+        with self._lock:
+            self._load()
+            return self._discovered.get(name)
+
+    def set_discovered(self, name:str, value:str) -> None:
+        with self._lock:
+            self._load()
+            self._discovered[name] = value
+            self._dirty = True
+
+    def key_lock(self, key:str) -> threading.Lock:
+        """
+        Held while producing a result so two jobs never build the same key at once
+        """
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def __contains__(self, key:str) -> bool:
+        with self._lock:
+            return key in self._load()
+
+    def get(self, key:str, *, shared:bool = True) -> CodeResult | None:
+        """
+        The result of key, from the shared store if it is not here and shared, None if neither have it
+        """
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is not None:
+                _PROFILER.count("cache hits")
+                entry["last_access"] = time.time()
+                self._dirty = True
+                return _code_result_from_json(entry)
+        if shared and (result := self._get_shared(key)) is not None:
+            _PROFILER.count("shared cache hits")
+            return result
+        _PROFILER.count("cache misses")
+        return None
+
+    def _get_shared(self, key:str) -> CodeResult | None:
+        if self.shared is None or (value := self.shared.get(key)) is None: return None
+        try:
+            result = _code_result_from_json(json.loads(value))
+        except (ValueError, TypeError, AttributeError):
+            return None
+        # kept here too, without artifacts as they were built elsewhere
+        self.put(key, result, shared=False)
+        return result
+
+    def fetch_shared(self, keys:Iterable[str]) -> None:
+        """
+        Get the results of keys not here from the shared store, so they are not built again
+        """
+        if self.shared is None: return
+        for key in keys:
+            if key not in self: self._get_shared(key)
+
+    def put(self, key:str, result:CodeResult, artifacts:Iterable[str] = (), *, shared:bool = True) -> None:
+        """
+        Store a result, artifacts are the files in the cache directory that belong to it.
+        Results other builds need the artifacts of (not just the result) are not shared.
+        """
+        artifact_names = [os.path.basename(artifact) for artifact in artifacts]
+        value = json.dumps(dataclasses.asdict(result)).encode()
+        # the outputs are kept in the manifest, so count towards the size as much as the artifacts
+        size = len(value) + sum(os.path.getsize(self.path_for(name)) for name in artifact_names if os.path.exists(self.path_for(name)))
+        entry = dataclasses.asdict(result)
+        entry.update({"artifacts": artifact_names, "size": size, "last_access": time.time()})
+        with self._lock:
+            self._load()[key] = entry
+            self._dirty = True
+        if shared and self.shared is not None: self.shared.put(key, value)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            entries = self._load()
+            accesses = [entry["last_access"] for entry in entries.values()]
+            return CacheStats(
+                entries=len(entries),
+                size=sum(entry["size"] for entry in entries.values()),
+                oldest_access=min(accesses, default=None),
+                newest_access=max(accesses, default=None),
+            )
+
+    def gc(self, *, max_size:int|None = None, max_age:float|None = None) -> int:
+        """
+        Evict entries older than max_age (seconds), then the least recently used until under max_size (bytes).
+        Files in the cache directory that no entry owns are removed too, unless a build may still be writing them.
+        Returns how many entries were evicted.
+        """
+        with self._lock:
+            entries = self._load()
+            now = time.time()
+            by_age = sorted(entries.items(), key=lambda item: item[1]["last_access"])
+            total_size = sum(entry["size"] for _, entry in by_age)
+            evicted: list[str] = []
+            for key, entry in by_age:
+                too_old = max_age is not None and now - entry["last_access"] > max_age
+                too_big = max_size is not None and total_size > max_size
+                if not (too_old or too_big): continue
+                evicted.append(key)
+                total_size -= entry["size"]
+            for key in evicted:
+                del entries[key]
+            owned = {artifact for entry in entries.values() for artifact in entry["artifacts"]}
+            if os.path.isdir(self.directory):
+                for file_name in os.listdir(self.directory):
+                    if file_name == self._MANIFEST_NAME or file_name in owned or file_name.endswith(".tmp"): continue
+                    path = os.path.join(self.directory, file_name)
+                    try:
+                        # results being built are only owned once they are put
+                        if now - os.path.getmtime(path) > self._UNOWNED_GRACE: os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            self._dirty = self._dirty or len(evicted) > 0
+        self.save()
+        return len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._entries = {}
+            self._discovered = {}
+            self._dirty = False
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty or self._entries is None: return
+            os.makedirs(self.directory, exist_ok=True)
+            # write then rename so an interrupted build never leaves a half written manifest
+            temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as manifest_file:
+                json.dump({"version": self._MANIFEST_VERSION, "entries": self._entries, "discovered": self._discovered}, manifest_file)
+            os.replace(temp_path, self.manifest_path)
+            self._dirty = False
+
+_RESULT_CACHE:Final = ResultCache()
+_DEFAULT_SHARED_CACHE:Final = "build/shared_cache"
+_DEFAULT_CACHE_MAX_SIZE:Final = "256M"
+_DEFAULT_CACHE_MAX_AGE_DAYS:Final = 30.0
+
+def parse_size(size:str) -> int:
+    """
+    Parse a size in bytes, with an optional K, M or G suffix
+    """
+    multipliers = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in multipliers: return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+def _discover(name:str, find:Callable[[], str], still_valid:Callable[[str], bool] = lambda found: shutil.which(found) is not None) -> str:
+    """
+    Use the result of find from a previous run if it is still valid, by default if the program still exists, otherwise find it and remember it
+    """
+    if (found := _RESULT_CACHE.discovered(name)) is not None and still_valid(found): return found
+    found = find()
+    _RESULT_CACHE.set_discovered(name, found)
+    return found
+
+@functools.cache
+def get_cpp_compiler() -> str:
+    """
+    Only looked for once a C++ block needs compiling
+    """
+    if (compiler := get_env("CXX")) is not None: return compiler
+    return _discover("cpp_compiler", _get_cpp_compiler)
+
+@functools.cache
+def _compiler_identity(compiler:str) -> str:
+    """
+    The compiler's version and target, the same for the same compiler wherever or however it is called.
+    Asked once per binary, a changed binary is asked again.
+    """
+    path = os.path.realpath(shutil.which(compiler) or compiler)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return compiler
+    def ask() -> str:
+        try:
+            version = subprocess.run((compiler, "--version"), capture_output=True, text=True).stdout
+            target = subprocess.run((compiler, "-dumpmachine"), capture_output=True, text=True).stdout
+        except OSError:
+            return compiler
+        # later lines of the version can name where it is installed
+        return f"{version.splitlines()[0] if version else ''}|{target.strip()}"
+    return _discover(f"cpp_compiler_identity|{path}|{stat.st_size}|{stat.st_mtime_ns}", ask, lambda _: True)
 
 def make_source_code(code:Code, meta:MetaData|None) -> tuple[Code, bool]:
     if "main" in code: return (code, True)
@@ -188,44 +693,479 @@ def make_source_code(code:Code, meta:MetaData|None) -> tuple[Code, bool]:
     else: return (r"int main() {" f"\n{code}\n" "}", True)
 
 
+@dataclass
+class ExecutionLimits:
+    """
+    Limits on running a compiled block, None is unlimited. Sizes are in bytes, times in seconds.
+    """
+    timeout: float | None = 10.0
+    cpu: int | None = 10
+    memory: int | None = parse_size("1G")
+    file_size: int | None = parse_size("16M")
+    output: int | None = parse_size("64K")
+
+    def with_overrides(self, overrides:str) -> "ExecutionLimits":
+        """
+        Apply space separated name=value overrides, e.g. 'timeout=2 memory=64M', 0 or none removes a limit
+        """
+        limits = dataclasses.replace(self)
+        for override in overrides.split():
+            name, _, value = override.partition("=")
+            name = name.strip().lower().replace("-", "_")
+            if name not in {field.name for field in dataclasses.fields(self)} or not value:
+                raise ValueError(f"Unknown execution limit {override}, expected name=value with a name of {', '.join(field.name for field in dataclasses.fields(self))}")
+            try:
+                if value.lower() in {"0", "none"}: parsed = None
+                elif name == "timeout": parsed = float(value)
+                elif name == "cpu": parsed = int(value)
+                else: parsed = parse_size(value)
+            except ValueError as e:
+                raise ValueError(f"Invalid execution limit {override}, {name} expects {'seconds' if name == 'timeout' else 'whole seconds' if name == 'cpu' else 'a size with an optional K, M or G suffix'}") from e
+            setattr(limits, name, parsed)
+        return limits
+
+    def limited_command(self, args:tuple[str, ...]) -> tuple[str, ...]:
+        """
+        args ran by sh after it sets the limits. No python runs between fork and exec, which is not safe with the build's threads
+        """
+        if os.name != "posix": return args
+        ulimits: list[str] = []
+        if self.cpu is not None: ulimits.append(f"ulimit -t {self.cpu}")
+        if self.memory is not None: ulimits.append(f"ulimit -v {max(self.memory // 1024, 1)}") # KiB
+        if self.file_size is not None: ulimits.append(f"ulimit -f {max(self.file_size // 512, 1)}") # 512 byte blocks
+        if not ulimits: return args
+        return ("/bin/sh", "-c", " && ".join(ulimits) + ' && exec "$0" "$@"') + args
+
+_CPP_LIMITS:Final = ExecutionLimits()
+
+def _capture_stream(stream:IO[bytes], limit:int|None, into:list[bytes]) -> None:
+    """
+    Keep the first limit bytes of a stream, keep reading (and dropping) the rest so the writer never blocks
+    """
+    kept = 0
+    dropped = 0
+    while chunk := stream.read1(1 << 16): # type: ignore[attr-defined]
+        if limit is not None and kept + len(chunk) > limit:
+            into.append(chunk[:limit - kept])
+            dropped += kept + len(chunk) - limit
+            kept = limit
+        else:
+            into.append(chunk)
+            kept += len(chunk)
+    if dropped: into.append(f"\n[{dropped} more bytes of output dropped]\n".encode())
+
+def run_limited(args:tuple[str, ...], limits:ExecutionLimits) -> RunResult:
+    """
+    Run args within limits, output is stderr then stdout each capped at limits.output
+    """
+    _PROFILER.count("subprocesses")
+    process = subprocess.Popen(limits.limited_command(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.stdout is not None and process.stderr is not None
+    stdout: list[bytes] = []
+    stderr: list[bytes] = []
+    readers = [
+        threading.Thread(target=_capture_stream, args=(process.stdout, limits.output, stdout), daemon=True),
+        threading.Thread(target=_capture_stream, args=(process.stderr, limits.output, stderr), daemon=True),
+    ]
+    for reader in readers: reader.start()
+    timed_out = False
+    try:
+        process.wait(timeout=limits.timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        timed_out = True
+    for reader in readers: reader.join()
+    process.stdout.close()
+    process.stderr.close()
+    output = b"".join(stderr).decode(errors="replace") + b"".join(stdout).decode(errors="replace")
+    if timed_out: output += f"\nTimed out after {limits.timeout:g} seconds"
+    return RunResult(output, process.returncode, timed_out=timed_out)
+
+@dataclass
+class CppBuildPlan:
+    """
+    How a C++ block is built and ran
+    """
+    source: Code
+    has_main: bool
+    compile_only: bool
+    compile_flags: tuple[str, ...]
+    limits: ExecutionLimits
+    key: str
+
+def _plan_cpp(code:Code, meta:MetaData|None) -> CppBuildPlan:
+    source, has_main = make_source_code(code, meta)
+    # Nothing is ran so only check the code, no codegen, linking or binary
+    compile_only = meta is not None and bool(meta.data.get("compile-only", False))
+    if compile_only: compile_flags: tuple[str, ...] = ("-fsyntax-only",)
+    else: compile_flags = () if has_main else ("-c",)
+    limits = _CPP_LIMITS
+    if meta is not None and (overrides := meta.data.get("limits")) is not None: limits = limits.with_overrides(overrides)
+    # limits change what running does, so are only part of the key when it is ran
+    runs = has_main and not compile_only
+    key = ResultCache.create_key("cpp", _compiler_identity(get_cpp_compiler()), compile_flags, source, dataclasses.astuple(limits) if runs else None)
+    return CppBuildPlan(source, has_main, compile_only, compile_flags, limits, key)
+
+_LEADING_INCLUDE_PATTERN:Final = re.compile(r"^\s*#\s*include\s*<(?P<header>[^<>]+)>\s*$")
+
+def _split_leading_includes(source:Code) -> tuple[frozenset[str], Code]:
+    headers: set[str] = set()
+    lines = source.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        if (include := _LEADING_INCLUDE_PATTERN.match(line)) is not None:
+            headers.add(include["header"].strip())
+        elif line.strip() and not line.strip().startswith("//"):
+            return frozenset(headers), "".join(lines[index:])
+    return frozenset(headers), ""
+
+def leading_includes(source:Code) -> frozenset[str]:
+    """
+    The <headers> included before anything else in the source.
+    Standard headers can be included in any order so preincluding any of these gives the same code.
+    """
+    return _split_leading_includes(source)[0]
+
+def choose_precompiled_headers(include_sets:Iterable[frozenset[str]], *, min_users:int = 2) -> tuple[str, ...]:
+    """
+    Greedily pick the headers that save the most parsing: headers included by many blocks,
+    only blocks that include every chosen header can use it.
+    """
+    include_sets = list(include_sets)
+    frequency: dict[str, int] = {}
+    for includes in include_sets:
+        for header in includes:
+            frequency[header] = frequency.get(header, 0) + 1
+    chosen: list[str] = []
+    best_score = 0
+    for header in sorted(frequency, key=lambda header: (-frequency[header], header)):
+        candidate = set(chosen) | {header}
+        users = sum(1 for includes in include_sets if candidate <= includes)
+        if users < min_users or users * len(candidate) <= best_score: continue
+        chosen.append(header)
+        best_score = users * len(candidate)
+    return tuple(sorted(chosen))
+
+def _build_precompiled_header(header_source:Code) -> str | None:
+    """
+    Build (or find in the cache) a precompiled header of header_source, returns the header to -include
+    """
+    key = ResultCache.create_key("cpp-pch", _compiler_identity(get_cpp_compiler()), header_source)
+    header_file_name = _RESULT_CACHE.path_for(key, ".hpp")
+    with _RESULT_CACHE.key_lock(key):
+        if (cached := _RESULT_CACHE.get(key, shared=False)) is not None:
+            return header_file_name if cached.compiles else None
+        with open(header_file_name, "w") as output:
+            output.write(header_source)
+        # both gcc and clang look for header.gch / header.pch next to an -include'd header
+        pch_file_name = header_file_name + (".pch" if "clang" in os.path.basename(get_cpp_compiler()) else ".gch")
+        _PROFILER.count("subprocesses")
+        with _PROFILER.span("precompile header"):
+            res = subprocess.run((get_cpp_compiler(), "-x", "c++-header", header_file_name, f"-o{pch_file_name}"), stderr=subprocess.PIPE)
+        compile_result = CompileResult(f"Precompiling {header_file_name}:\n" + res.stderr.decode(), res.returncode)
+        _RESULT_CACHE.put(key, CodeResult(compile_result=compile_result, run_result=None), artifacts=(header_file_name, pch_file_name), shared=False)
+        # blocks compile without it instead, they report any errors
+        return header_file_name if compile_result.compiles else None
+
+# Roughly how much snippet code has to be compiled again before precompiling it beats
+#  the precompiled standard headers every other block uses
+_MIN_CHECKPOINT_SAVING:Final = 5_000
+
+def choose_append_checkpoints(sources:dict[int, Code], to_build:Iterable[int], *, min_users:int = 2) -> dict[int, int]:
+    """
+    Append chains repeat the code of the block they append to. Pick blocks to precompile (checkpoints)
+    so the blocks extending them only compile their own code, returns {block: checkpoint}.
+    Sources are only given for blocks that can be a header, i.e. not wrapped in main.
+    """
+    # included headers are cheap to everyone through the precompiled standard headers
+    code_lengths = {block: len(_split_leading_includes(source)[1]) for block, source in sources.items()}
+    extends: dict[int, list[int]] = {}
+    for block in to_build:
+        if block not in sources: continue
+        for prefix_block, prefix in sources.items():
+            if prefix_block != block and len(prefix) < len(sources[block]) and sources[block].startswith(prefix):
+                extends.setdefault(prefix_block, []).append(block)
+    # gcc cannot build a precompiled header using another, so building a checkpoint means compiling
+    #  the whole prefix again. Only one checkpoint per chain, the one that saves the most code being compiled again
+    checkpoints: dict[int, int] = {}
+    while extends:
+        best = max(extends, key=lambda prefix_block: code_lengths[prefix_block] * len(extends[prefix_block]))
+        users = extends[best]
+        if len(users) < min_users or code_lengths[best] * len(users) < _MIN_CHECKPOINT_SAVING: break
+        checkpoints.update({block: best for block in users})
+        extends = {prefix_block: others for prefix_block, others in extends.items() if not set(others) & set(users)}
+    return checkpoints
+
+def prepare_cpp_build(blocks:"list[CodeBlock]") -> None:
+    """
+    Precompile the code append chains share, then the standard headers most of the other (not yet cached) blocks start with.
+    Then batch the blocks that are never ran so they share compiler runs.
+    Blocks expected to not compile are never precompiled for, so their errors read the same as without.
+    """
+    # blocks built on another machine are neither precompiled for nor batched
+    _RESULT_CACHE.fetch_shared(_plan_cpp(block.code, block.meta).key for block in blocks)
+    # keyed by index in blocks
+    header_sources: dict[int, Code] = {}
+    to_build_indexes: list[int] = []
+    for index, block in enumerate(blocks):
+        plan = _plan_cpp(block.code, block.meta)
+        if plan.source == block.code: header_sources[index] = plan.source
+        if plan.key in _RESULT_CACHE: continue
+        if block.meta is not None and bool(block.meta.data.get("no-pch", False)): continue
+        to_build_indexes.append(index)
+    def set_pch(block:"CodeBlock", header_file_name:str, prefix_length:int = 0) -> None:
+        block.meta = MetaData() if block.meta is None else block.meta
+        block.meta.data["pch"] = header_file_name
+        if prefix_length: block.meta.data["pch-prefix-length"] = str(prefix_length)
+
+    checkpoints = choose_append_checkpoints(header_sources, to_build_indexes)
+    checkpoint_headers: dict[int, str | None] = {}
+    for index, checkpoint in checkpoints.items():
+        if checkpoint not in checkpoint_headers:
+            # diagnostics in the checkpoint point at the file it came from
+            line_directive = f'#line 1 "{_RESULT_CACHE.path_for(_plan_cpp(blocks[checkpoint].code, blocks[checkpoint].meta).key, ".cpp")}"\n'
+            checkpoint_headers[checkpoint] = _build_precompiled_header(line_directive + header_sources[checkpoint])
+        if (header_file_name := checkpoint_headers[checkpoint]) is not None:
+            set_pch(blocks[index], header_file_name, len(header_sources[checkpoint]))
+
+    to_build: list[tuple["CodeBlock", Code]] = []
+    for index in to_build_indexes:
+        block = blocks[index]
+        if block.meta is not None and "pch" in block.meta.data: continue
+        to_build.append((block, _plan_cpp(block.code, block.meta).source))
+    headers = choose_precompiled_headers(leading_includes(source) for _, source in to_build)
+    header_file_name = _build_precompiled_header("".join(f"#include <{header}>\n" for header in headers)) if headers else None
+    if header_file_name is not None:
+        for block, source in to_build:
+            if set(headers) <= leading_includes(source): set_pch(block, header_file_name)
+    # after choosing headers, blocks only share a compiler run when they use the same one
+    _CPP_BATCHER.plan(blocks)
+
+def _cpp_compile_flags(plan:CppBuildPlan, meta:MetaData|None) -> tuple[str, ...]:
+    # a precompiled header only makes the compile faster, so it is not part of the key
+    if meta is not None and (pch_header := meta.data.get("pch")) is not None:
+        return ("-include", pch_header) + plan.compile_flags
+    return plan.compile_flags
+
+def _write_cpp_sources(plan:CppBuildPlan, meta:MetaData|None) -> tuple[str, str, tuple[str, ...]]:
+    """
+    Write the block's source (and the part of it not in its precompiled header), returns (source file, file to compile, artifacts)
+    """
+    source = plan.source
+    # the start of the source is already in the precompiled header, only the rest is compiled
+    prefix_length = int(meta.data.get("pch-prefix-length", 0)) if meta is not None else 0
+    source_file_name = _RESULT_CACHE.path_for(plan.key, ".cpp")
+    with open(source_file_name, "w") as output:
+        output.write(source)
+    if not prefix_length: return source_file_name, source_file_name, (source_file_name,)
+    compile_file_name = _RESULT_CACHE.path_for(plan.key, ".part.cpp")
+    with open(compile_file_name, "w") as output:
+        # keeps diagnostics pointing at the lines of the full source
+        output.write(f'#line {source.count("\n", 0, prefix_length) + 1} "{source_file_name}"\n' + source[prefix_length:])
+    return source_file_name, compile_file_name, (source_file_name, compile_file_name)
+
 def handle_cpp(code:Code,
                 flags:CompileExecFlags|None = None,
                 meta: MetaData|None = None
             ) -> CodeResult:
-    file_name = f"build/{_create_unique_file_name(code, meta)}"
-    source_file_name = f"{file_name}.cpp"
-    exe_file_name = f"{file_name}"
-    source, has_main = make_source_code(code, meta)
-    # assumes no overlap with checksums
-    if not os.path.exists(source_file_name):
-        with open(source_file_name, "w") as output:
-            output.write(source)
-    if not os.path.exists(exe_file_name):
-        exe_file_name += ".o" if not has_main else ""
-        compile_args = (_CPP_COMPILER, f"-o{exe_file_name}", source_file_name)
-        if not has_main:
-            compile_args:tuple[str, ...] = compile_args + ("-c",)
-        res = subprocess.run(compile_args, stderr=subprocess.PIPE)
-        compile_result = CompileResult(f"Compiling {file_name}:\n" + res.stderr.decode(), res.returncode )
-        if res.returncode != 0: return CodeResult(compile_result=compile_result, run_result=None)
-    else:
-        compile_result = CompileResult("Cached", 0)
-    run_result = None
-    if has_main:
-        res = subprocess.run((f"./{exe_file_name}"), stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        run_result = RunResult(f"Running {file_name}" + res.stderr.decode() + res.stdout.decode(), res.returncode)
-    return CodeResult(run_result=run_result, compile_result=compile_result)
+    plan = _plan_cpp(code, meta)
+    has_main, compile_only, key = plan.has_main, plan.compile_only, plan.key
+    compile_flags = _cpp_compile_flags(plan, meta)
+    if meta is not None and (batch := meta.data.get("cpp-batch")) is not None: _CPP_BATCHER.compile(batch)
+    with _RESULT_CACHE.key_lock(key):
+        # built by its batch just now, so it was not a cache hit
+        if (batched := _CPP_BATCHER.take(key)) is not None:
+            _PROFILER.count("cache misses")
+            return batched
+        if (cached := _RESULT_CACHE.get(key)) is not None: return cached
+        source_file_name, compile_file_name, artifacts = _write_cpp_sources(plan, meta)
+        if compile_only:
+            exe_file_name = None
+            compile_args = (get_cpp_compiler(), compile_file_name) + compile_flags
+        else:
+            exe_file_name = _RESULT_CACHE.path_for(key, "" if has_main else ".o")
+            artifacts += (exe_file_name,)
+            compile_args = (get_cpp_compiler(), f"-o{exe_file_name}", compile_file_name) + compile_flags
+        _PROFILER.count("subprocesses")
+        with _PROFILER.span("compile"):
+            res = subprocess.run(compile_args, stderr=subprocess.PIPE)
+        compile_result = CompileResult(f"Compiling {source_file_name}:\n" + res.stderr.decode(), res.returncode )
+        run_result = None
+        if res.returncode == 0 and has_main and exe_file_name is not None:
+            with _PROFILER.span("run"):
+                run_result = run_limited((f"./{exe_file_name}",), plan.limits)
+            run_result.run_output = f"Running {exe_file_name}" + run_result.run_output
+        result = CodeResult(run_result=run_result, compile_result=compile_result)
+        # a loaded machine can time out what would normally finish, so try it again next build
+        if not result.timed_out: _RESULT_CACHE.put(key, result, artifacts=artifacts)
+        return result
 
-def handle_python(code:str,
-                  flags:CompileExecFlags|None = None,
-                  meta: MetaData|None = None
-                ) -> CodeResult:
-    print_result:str = ""
+_INCLUDED_FROM:Final = re.compile(r"^(?:In file included from|\s+from) ")
+_CPP_ERROR:Final = re.compile(r"\berror:")
+
+def split_diagnostics(output:str, owners:dict[str, int]) -> dict[int | None, str]:
+    """
+    Split compiler output about many files into what is about each, owners maps file names to who they belong to.
+    Output before any owned file is named is kept under None.
+    """
+    if not owners: return {None: output}
+    names = re.compile("|".join(re.escape(name) for name in sorted(owners, key=len, reverse=True)))
+    split: dict[int | None, list[str]] = {}
+    owner: int | None = None
+    # an include stack is printed before the line naming the file it is about
+    pending: list[str] = []
+    for line in output.splitlines(keepends=True):
+        if (name := names.search(line)) is not None: owner = owners[name.group()]
+        pending.append(line)
+        if _INCLUDED_FROM.match(line): continue
+        split.setdefault(owner, []).extend(pending)
+        pending.clear()
+    if pending: split.setdefault(owner, []).extend(pending)
+    return {owner: "".join(lines) for owner, lines in split.items()}
+
+class CppBatcher:
+    """
+    Compiles blocks that are never ran (no main or compile only) `size` at a time in one compiler run,
+    each its own translation unit, instead of starting the compiler for every block.
+    Diagnostics are split back to the block they are about, blocks are only compiled alone when a batch fails for a reason
+    no block is blamed for.
+    """
+    def __init__(self, size:int = 8) -> None:
+        self.size = size
+        self._batches: dict[str, list[tuple[CppBuildPlan, MetaData|None]]] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        # results a batch built, until the block they belong to takes them
+        self._built: dict[str, CodeResult] = {}
+        self._lock = threading.Lock()
+
+    def plan(self, blocks:"list[CodeBlock]") -> None:
+        """
+        Put the (not yet cached) blocks that compile with the same flags into batches, handle_cpp compiles a block's batch
+        """
+        if self.size <= 1: return
+        groups: dict[tuple[str, ...], list[CodeBlock]] = {}
+        # the same code in other decks is another block, it waits for the batch building its key too
+        same_key: dict[str, list[CodeBlock]] = {}
+        for block in blocks:
+            plan = _plan_cpp(block.code, block.meta)
+            if (plan.has_main and not plan.compile_only) or plan.key in _RESULT_CACHE: continue
+            if plan.key in same_key:
+                same_key[plan.key].append(block)
+                continue
+            same_key[plan.key] = [block]
+            groups.setdefault(_cpp_compile_flags(plan, block.meta), []).append(block)
+        for group in groups.values():
+            for start in range(0, len(group), self.size):
+                batch = group[start:start + self.size]
+                if len(batch) < 2: continue
+                plans = [(_plan_cpp(block.code, block.meta), block.meta) for block in batch]
+                batch_id = ResultCache.create_key("cpp-batch", [plan.key for plan, _ in plans])
+                with self._lock:
+                    self._batches[batch_id] = plans
+                    self._locks[batch_id] = threading.Lock()
+                for plan, _ in plans:
+                    for block in same_key[plan.key]:
+                        block.meta = MetaData() if block.meta is None else block.meta
+                        block.meta.data["cpp-batch"] = batch_id
+
+    def compile(self, batch_id:str) -> None:
+        """
+        Compile a batch into the result cache, only the first block of it to get here does
+        """
+        with self._lock:
+            lock = self._locks.get(batch_id)
+        if lock is None: return
+        with lock:
+            with self._lock:
+                batch = self._batches.pop(batch_id, None)
+            if batch is not None: self._compile(batch)
+
+    def take(self, key:str) -> CodeResult | None:
+        """
+        The result of key if its batch built it (rather than it being cached before), only once
+        """
+        with self._lock:
+            return self._built.pop(key, None)
+
+    def _compile(self, batch:list[tuple[CppBuildPlan, MetaData|None]]) -> None:
+        # the files of its keys are the batch's to write, no block builds one of them alone meanwhile
+        with contextlib.ExitStack() as key_locks:
+            for key in sorted({plan.key for plan, _ in batch}):
+                key_locks.enter_context(_RESULT_CACHE.key_lock(key))
+            self._compile_locked(batch)
+
+    def _compile_locked(self, batch:list[tuple[CppBuildPlan, MetaData|None]]) -> None:
+        batch = [(plan, meta) for plan, meta in batch if plan.key not in _RESULT_CACHE]
+        if len(batch) < 2: return
+        plan, meta = batch[0]
+        compile_flags = _cpp_compile_flags(plan, meta)
+        # ran in the cache directory so object files are written there, so every path is absolute
+        if "-include" in compile_flags:
+            index = compile_flags.index("-include") + 1
+            compile_flags = compile_flags[:index] + (os.path.abspath(compile_flags[index]),) + compile_flags[index + 1:]
+        files = [_write_cpp_sources(plan, meta) for plan, meta in batch]
+        compile_paths = [os.path.abspath(compile_file_name) for _, compile_file_name, _ in files]
+        owners = {path: index for index, path in enumerate(compile_paths)}
+        owners.update({source_file_name: index for index, (source_file_name, _, _) in enumerate(files)})
+        _PROFILER.count("subprocesses")
+        with _PROFILER.span("compile batch"):
+            res = subprocess.run((get_cpp_compiler(),) + compile_flags + tuple(compile_paths), stderr=subprocess.PIPE, cwd=_RESULT_CACHE.directory)
+        diagnostics = split_diagnostics(res.stderr.decode(), owners)
+        # the compiler carries on after a file with errors, so only errors about no file in particular leave the others unknown
+        unknown = res.returncode != 0 and _CPP_ERROR.search(diagnostics.get(None, "")) is not None
+        for index, ((plan, _), (source_file_name, compile_file_name, artifacts)) in enumerate(zip(batch, files)):
+            output = diagnostics.get(index, "").replace(compile_paths[index], compile_file_name)
+            failed = _CPP_ERROR.search(output) is not None
+            if unknown and not failed: continue
+            if not plan.compile_only:
+                object_file_name = os.path.join(_RESULT_CACHE.directory, os.path.splitext(os.path.basename(compile_file_name))[0] + ".o")
+                exe_file_name = _RESULT_CACHE.path_for(plan.key, ".o")
+                if not failed:
+                    if not os.path.exists(object_file_name): continue
+                    os.replace(object_file_name, exe_file_name)
+                artifacts += (exe_file_name,)
+            compile_result = CompileResult(f"Compiling {source_file_name}:\n" + output, res.returncode if failed else 0)
+            result = CodeResult(compile_result=compile_result, run_result=None)
+            _RESULT_CACHE.put(plan.key, result, artifacts=artifacts)
+            with self._lock:
+                self._built[plan.key] = result
+
+_CPP_BATCHER:Final = CppBatcher()
+
+class OutputCapture:
+    """
+    Keeps the first limit characters written, counting (and dropping) the rest
+    """
+    def __init__(self, limit:int|None = None) -> None:
+        self.limit = limit
+        self._parts: list[str] = []
+        self._kept = 0
+        self._dropped = 0
+
+    def write(self, text:str) -> None:
+        if self.limit is not None and self._kept + len(text) > self.limit:
+            keep = self.limit - self._kept
+            if keep > 0: self._parts.append(text[:keep])
+            self._kept += keep
+            self._dropped += len(text) - keep
+        else:
+            self._parts.append(text)
+            self._kept += len(text)
+
+    def getvalue(self) -> str:
+        dropped = f"\n[{self._dropped} more characters of output dropped]\n" if self._dropped else ""
+        return "".join(self._parts) + dropped
+
+def exec_python(code:str, flags:CompileExecFlags|None = None, *, output_limit:int|None = None) -> CodeResult:
+    """
+    Run python code in this process with print, exit and open mocked, keeping up to output_limit characters printed
+    """
+    output = OutputCapture(output_limit)
     exit_code:int = 0
     exit_str:str = ""
     def mock_print(*value:object, end:str="\n"):
-        nonlocal print_result
-        print_result += "".join((str(v) for v in value)) + end
+        for v in value: output.write(str(v))
+        output.write(end)
     def mock_exit(value:int|str):
         nonlocal exit_code
         nonlocal exit_str
@@ -244,25 +1184,182 @@ def handle_python(code:str,
     _globals.update({"print": mock_print, "exit":mock_exit, "open": mock_open})
     try:
         exec(code, _globals, _locals)
-        return CodeResult(None, RunResult(print_result + exit_str, exit_code))
+        return CodeResult(None, RunResult(output.getvalue() + exit_str, exit_code))
+    except SystemExit as e:
+        # like python exiting: None is success, other values than an int are printed and fail
+        if e.code is None or isinstance(e.code, int): return CodeResult(None, RunResult(output.getvalue(), e.code or 0))
+        return CodeResult(None, RunResult(output.getvalue() + str(e.code), 1))
     except Exception as e:
         unwrapped_exception:list[str] = traceback.format_exception(e)
-        return CodeResult(None, RunResult(print_result + "".join(unwrapped_exception), 1))
+        return CodeResult(None, RunResult(output.getvalue() + "".join(unwrapped_exception), 1))
+
+def _python_worker(connection:"multiprocessing.connection.Connection", memory_limit:int|None, output_limit:int|None) -> None:
+    """
+    Runs in a worker process: receives code, sends back (output, return code) until given None
+    """
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    while True:
+        try:
+            code = connection.recv()
+        except EOFError:
+            return
+        if code is None: return
+        result = exec_python(code, output_limit=output_limit)
+        assert result.run_result is not None
+        connection.send((result.run_result.run_output, result.run_result.return_code))
 
-_DEFAULT_HANDLER.add_language("Cpp", handle_cpp)
-_DEFAULT_HANDLER.add_language("C++", handle_cpp)
-_DEFAULT_HANDLER.add_language("Python", handle_python)
-_DEFAULT_HANDLER.add_language("py", handle_python)
+# Same as the timeout command
+_TIMED_OUT_RETURN_CODE:Final = 124
+
+class PythonWorkerPool:
+    """
+    Worker processes that python blocks are ran in, so a block cannot hang, bloat or change the build.
+    Workers are started ahead of use and replaced after max_tasks blocks, or when a block times out or crashes them.
+    """
+    def __init__(self, *, workers:int = 1, timeout:float|None = 30.0, memory_limit:int|None = parse_size("512M"), output_limit:int|None = parse_size("64K"), max_tasks:int = 25) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        # address space limits are POSIX only
+        self.memory_limit = memory_limit if os.name == "posix" else None
+        self.output_limit = output_limit
+        self.max_tasks = max_tasks
+        self._idle: "queue.SimpleQueue[_PythonWorker]" = queue.SimpleQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _start_worker(self) -> "_PythonWorker":
+        import multiprocessing
+        # spawn so workers never inherit the build's threads or state
+        context = multiprocessing.get_context("spawn")
+        parent_connection, child_connection = context.Pipe()
+        process = context.Process(target=_python_worker, args=(child_connection, self.memory_limit, self.output_limit), daemon=True)
+        _PROFILER.count("subprocesses")
+        process.start()
+        child_connection.close()
+        return _PythonWorker(process, parent_connection)
+
+    def warm(self, count:int) -> None:
+        """
+        Start up to count workers now, they import while other work happens
+        """
+        with self._lock:
+            while self._started < min(count, self.workers):
+                self._idle.put(self._start_worker())
+                self._started += 1
+
+    def _acquire(self) -> "_PythonWorker":
+        with self._lock:
+            if self._idle.empty() and self._started < self.workers:
+                self._started += 1
+                return self._start_worker()
+        return self._idle.get()
+
+    def _release(self, worker:"_PythonWorker", *, healthy:bool) -> None:
+        worker.tasks += 1
+        if healthy and worker.tasks < self.max_tasks:
+            self._idle.put(worker)
+            return
+        worker.stop()
+        self._idle.put(self._start_worker())
+
+    def run(self, code:str) -> CodeResult:
+        worker = self._acquire()
+        healthy = False
+        try:
+            worker.connection.send(code)
+            if not worker.connection.poll(self.timeout):
+                return CodeResult(None, RunResult(f"Timed out after {self.timeout:g} seconds", _TIMED_OUT_RETURN_CODE, timed_out=True))
+            output, return_code = worker.connection.recv()
+            healthy = True
+            return CodeResult(None, RunResult(output, return_code))
+        except (EOFError, OSError):
+            # the exit code is only known once the dead worker is joined, it is replaced on release
+            worker.process.join(1)
+            return CodeResult(None, RunResult(f"Python worker exited with code {worker.process.exitcode}", 1))
+        finally:
+            self._release(worker, healthy=healthy)
+
+    def close(self) -> None:
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get().stop()
+            self._started = 0
+
+@dataclass
+class _PythonWorker:
+    process: "multiprocessing.process.BaseProcess"
+    connection: "multiprocessing.connection.Connection"
+    tasks: int = 0
+
+    def stop(self) -> None:
+        if self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(0.1)
+        if self.process.is_alive(): self.process.kill()
+        self.connection.close()
+
+_PYTHON_POOL:Final = PythonWorkerPool()
+atexit.register(_PYTHON_POOL.close)
+
+def handle_python(code:str,
+                  flags:CompileExecFlags|None = None,
+                  meta: MetaData|None = None
+                ) -> CodeResult:
+    # globals/locals given in flags are shared with the caller so have to run here, and can change what it does
+    if flags is not None and isinstance(flags.flags, dict) and ("globals" in flags.flags or "locals" in flags.flags):
+        with _PROFILER.span("run"): return exec_python(code, flags, output_limit=_PYTHON_POOL.output_limit)
+    key = _python_key(code)
+    with _RESULT_CACHE.key_lock(key):
+        if (cached := _RESULT_CACHE.get(key)) is not None: return cached
+        with _PROFILER.span("run"): result = _PYTHON_POOL.run(code)
+        # a loaded machine can time out what would normally finish, so try it again next build
+        if not result.timed_out: _RESULT_CACHE.put(key, result)
+        return result
+
+def _python_key(code:str) -> str:
+    return ResultCache.create_key("python", sys.version, code, _PYTHON_POOL.timeout, _PYTHON_POOL.memory_limit, _PYTHON_POOL.output_limit)
+
+def prepare_python_build(blocks:"list[CodeBlock]") -> None:
+    """
+    Start workers for the blocks that are not cached, none when every block is
+    """
+    keys = [_python_key(block.code) for block in blocks]
+    _RESULT_CACHE.fetch_shared(keys)
+    if (to_run := sum(1 for key in keys if key not in _RESULT_CACHE)): _PYTHON_POOL.warm(to_run)
+
+_DEFAULT_HANDLER.add_language("Cpp", handle_cpp, prepare=prepare_cpp_build)
+_DEFAULT_HANDLER.add_language("C++", handle_cpp, prepare=prepare_cpp_build)
+_DEFAULT_HANDLER.add_language("Python", handle_python, prepare=prepare_python_build)
+_DEFAULT_HANDLER.add_language("py", handle_python, prepare=prepare_python_build)
+
+_ASSERT_COMPILE_TAGS:Final = frozenset({"compiles", "compiling"})
+_ASSERT_RUN_TAGS:Final = frozenset({"running", "runs"})
+_ASSERT_ERROR_TAGS:Final = frozenset({"erroring", "errors", "error"})
+_ASSERT_FAILS_COMPILE_TAGS:Final = frozenset({"not-compiling", "not-compiles", "not-compile", "does-not-compile", "compile-error"})
+_RUN_TAGS:Final = frozenset({"run",})
+_COMPILE_TAGS:Final = frozenset({"compile",})
+# Only whether these compile is checked, so they never need running (or linking)
+_COMPILE_ONLY_TAGS:Final = _ASSERT_COMPILE_TAGS | _ASSERT_FAILS_COMPILE_TAGS | _COMPILE_TAGS
+
+def wants_to_run(wants:str) -> bool:
+    return len(set(wants.lower().split()) & _COMPILE_ONLY_TAGS) == 0
+
+def wants_compile_error(wants:str) -> bool:
+    return len(set(wants.lower().split()) & _ASSERT_FAILS_COMPILE_TAGS) != 0
 
 def result_to_string(result:CodeResult, wants:str) -> str:
     _wants = set(wants.lower().split())
 
-    assert_compile_tags = {"compiles", "compiling"}
-    assert_run_tags = {"running", "runs"}
-    assert_error_tags = {"erroring", "errors", "error"}
-    assert_fails_compile_tags = {"not-compiling", "not-compiles", "not-compile", "does-not-compile", "compile-error"}
-    run_tags = {"run",}
-    compile_tags = {"compile",}
+    assert_compile_tags = _ASSERT_COMPILE_TAGS
+    assert_run_tags = _ASSERT_RUN_TAGS
+    assert_error_tags = _ASSERT_ERROR_TAGS
+    assert_fails_compile_tags = _ASSERT_FAILS_COMPILE_TAGS
+    run_tags = _RUN_TAGS
+    compile_tags = _COMPILE_TAGS
     all = assert_compile_tags | assert_run_tags | assert_error_tags | assert_fails_compile_tags | run_tags | compile_tags
     _wants.intersection_update(all)
     if len(_wants) == 0: raise Exception(f"wants was ignored: {wants} does not include one of {', '.join(all)}")
@@ -272,6 +1369,7 @@ def result_to_string(result:CodeResult, wants:str) -> str:
         compile_msg =  "" if result.compile_result is None else result.compile_result.compiler_output 
         run_msg = "" if result.run_result is None else result.run_result.run_output
         run_code = "" if result.run_result is None or result.runs else result.run_result.return_code
+        run_code = f"{run_code} (timed out)" if result.timed_out else run_code
         return Exception(f'{msg} because wants contains "{want}" (in {wants})\n'
                          f' \n\nCOMPILE:\n {compile_msg}\n\nRUNNING: {run_msg}\n\n'
                          f' Code: {run_code}')
@@ -284,11 +1382,12 @@ def result_to_string(result:CodeResult, wants:str) -> str:
         return "rayjs-running"
     if want in assert_error_tags:
         if result.runs: raise create_exception(f'Code ran but expected to error')
-        return "rayjs-erroring"
+        return "rayjs-timing-out" if result.timed_out else "rayjs-erroring"
     if want in assert_fails_compile_tags:
         if result.compiles: raise create_exception(f'Code compiled but expected to not compile')
         return "rayjs-not-compiling"
     if want in run_tags:
+        if result.timed_out: return "rayjs-timing-out"
         return "rayjs-running" if result.runs else ("rayjs-erroring" if result.compiles else "rayjs-not-compiling")
     if want in compile_tags:
         return "rayjs-compiling" if result.compiles else "rayjs-not-compiling"
@@ -297,30 +1396,129 @@ def result_to_string(result:CodeResult, wants:str) -> str:
 
 
 
-_FIND_CODE_PATTERN = (
-    r"(?:^```)(?P<lang>[A-Za-z+]{2,10})(?:.{0,40})$(?:\r?\n)(?P<code>(?:[^\`]){3,}?)(?:```$\n)(?:\<\!\-\- \.element: )(?:(?:class=\")(?P<outclass>[ A-Za-z0-9\-_]*?)(?:\"\s?))?(?P<wantstag>wants)(?:=\")(?P<outwants>[-\s\w]*?)(?:\")(?:(?:\s+id=)(?P<id>[\"'\w]+))?(?: \-\-\>)"
-)
+@dataclass
+class CodeFence:
+    """
+    A fenced code block whose element comment (on the line after it) says what its code should do
+    """
+    language: str
+    code: Code
+    wants: str
+    css_class: str | None
+    id: str | None
+    limits: str | None
+    line: int # of the opening fence, counting from 1
+    wants_span: tuple[int, int] # where `wants="..."` is in the markdown, replaced once the code has been handled
 
-_COMPILED_REGEX = re.compile(_FIND_CODE_PATTERN, re.MULTILINE)
+_FENCE_OPEN:Final = re.compile(r"(?P<fence>`{3,})[ \t]*(?P<language>[A-Za-z+#]*)[^`]*$")
+_ELEMENT_COMMENT:Final = re.compile(r"<!--\s*\.element:(?P<attributes>.*?)-->")
+_TAG_ATTRIBUTE:Final = re.compile(r"\s*(?P<name>[\w-]+)\s*=\s*(?:\"(?P<double>[^\"]*)\"|'(?P<single>[^']*)'|(?P<bare>\S+))")
 
-def for_each_code_block(
-            input:Markdown,
-            meta:MetaData|None=None,
-            code_handler: CodeHandlerRegistry | None = None,
-        ) -> Markdown:
+type FenceReporter = Callable[[int, str], None]
+
+def _element_attributes(text:str, line:int, report:FenceReporter) -> dict[str, tuple[str, int, int]] | None:
+    """
+    Attributes of the element comment in text (in any order) with where each is in the line
+    """
+    comment = _ELEMENT_COMMENT.search(text)
+    if comment is None:
+        report(line, "element comment must end with --> on the same line")
+        return None
+    attributes: dict[str, tuple[str, int, int]] = {}
+    position, end = comment.span("attributes")
+    while text[position:end].strip():
+        attribute = _TAG_ATTRIBUTE.match(text, position, end)
+        if attribute is None:
+            report(line, f"could not read attributes from {text[position:end].strip()!r}")
+            break
+        name = attribute.group("name").lower()
+        value = next(value for value in attribute.group("double", "single", "bare") if value is not None)
+        if attribute.group("bare") is not None and ('"' in value or "'" in value):
+            report(line, f"unbalanced quotes in {attribute.group().strip()}")
+            value = value.strip("\"'")
+        if name in attributes: report(line, f"{name} is given more than once, using the last")
+        attributes[name] = (value, attribute.start("name"), attribute.end())
+        position = attribute.end()
+    return attributes
+
+def scan_code_fences(lines:Iterable[str], *, report:FenceReporter | None = None) -> Iterable[CodeFence]:
+    """
+    Find the code blocks that want handling in a single pass over markdown lines (line endings kept, e.g. a file).
+    Code may contain backticks, only a line of at least as many backticks as opened the block closes it.
+    Element comments with wants that cannot be used are given to report with their line number.
+    """
+    report = report if report is not None else (lambda line, message: print(f"Warning: line {line}: {message}"))
+    fence: re.Match[str] | None = None # of the block being read
+    fence_line = 0
+    code_lines: list[str] = []
+    # a closed block, its element comment can only be on the next line
+    closed: tuple[re.Match[str], int, Code] | None = None
+    offset = 0
+    for number, line in enumerate(lines, start=1):
+        text = line.rstrip("\r\n")
+        if fence is not None:
+            closing = text.strip()
+            if len(closing) >= len(fence.group("fence")) and closing == "`" * len(closing):
+                closed = (fence, fence_line, "".join(code_lines))
+                fence = None
+            else: code_lines.append(text + "\n")
+        else:
+            if ".element" in text and "wants" in text:
+                attributes = _element_attributes(text, number, report)
+                if attributes is not None and "wants" in attributes:
+                    if closed is None: report(number, "wants is ignored, it must be on the line right after a code block")
+                    elif not closed[0].group("language"): report(number, f"wants is ignored, the code block (line {closed[1]}) has no language")
+                    else:
+                        wants, wants_start, wants_end = attributes["wants"]
+                        def value_of(name:str) -> str | None: return attributes[name][0] if name in attributes else None
+                        yield CodeFence(
+                            language=closed[0].group("language"), code=closed[2], wants=wants, css_class=value_of("class"),
+                            id=value_of("id"), limits=value_of("limits"), line=closed[1],
+                            wants_span=(offset + wants_start, offset + wants_end),
+                        )
+            elif (opening := _FENCE_OPEN.match(text)) is not None:
+                fence, fence_line, code_lines = opening, number, []
+            closed = None
+        offset += len(line)
+    if fence is not None: report(fence_line, "code block is never closed")
+
+@dataclass
+class CodeBlock:
+    """
+    A code block found in markdown, append chains are already resolved into code
+    """
+    language: RuntimeLanguage
+    code: Code
+    meta: MetaData|None
+    fence: CodeFence
+
+def collect_code_blocks(input:Markdown, meta:MetaData|None=None, code_handler:CodeHandlerRegistry|None=None) -> list[CodeBlock]:
+    """
+    Find every code block that wants handling, in the order they appear
+    """
     previous_language_data: dict[Language, dict[str, Code]] = {}
-    def on_match(full_match:re.Match[str]) -> str:
-        groups = full_match.groupdict()
-        reconstructed = full_match.string[full_match.start():full_match.end()]
-        language = groups["lang"]
-        wants = groups["outwants"].lower().replace("_", "-")
+    # no-main carries on to the following blocks in the same file
+    file_meta_data: dict[str, str] | None = dict(meta.data) if meta is not None else None
+    file_name = meta.data.get("filename", "unknown file") if meta is not None else "unknown file"
+    def report(line:int, message:str) -> None:
+        print(f"Warning: {file_name} line {line}: {message}")
+    registry: CodeHandlerRegistry = _DEFAULT_HANDLER if code_handler is None else code_handler
+    blocks: list[CodeBlock] = []
+    for fence in scan_code_fences(io.StringIO(input), report=report):
+        wants = fence.wants.lower().replace("_", "-")
         if "nothing" in wants:
-            print("Did not run code for language: ", language, " because wants was ", groups["outwants"])
-            return reconstructed
-        language = RuntimeLanguage(language)
-        code :Code = groups["code"]
-        id:str = groups["id"] if groups["id"] is not None else "last"
-        id = id.replace('"', "").lower()
+            print("Did not run code for language: ", fence.language, " because wants was ", fence.wants)
+            continue
+        try:
+            language = RuntimeLanguage(fence.language)
+        except RuntimeError:
+            # no handler can be registered for names that are not a RuntimeLanguage
+            language = None
+        if language is None or not registry.can_handle(language):
+            report(fence.line, f"wants is ignored, cannot handle {fence.language} code")
+            continue
+        code :Code = fence.code
+        id:str = fence.id.lower() if fence.id is not None else "last"
         if "append" in wants:
             # get the next word after append, else "last"
             if (start := wants.find("append-")) > 0:
@@ -343,51 +1541,672 @@ def for_each_code_block(
             #  so if we append again it still works
         previous_language_data.setdefault(language, {})[id] = code
         if id != "last": previous_language_data.setdefault(language, {})["last"] = code
-        # print("Set data")
-        _meta = meta
         if "no-main" in wants:
-            _meta = MetaData() if meta is None else meta
-            _meta.data["no-main"] = "True"
-        # flags are None for now, expected to be populated via regex
-        code_result:CodeResult = handle_code(language, code, code_handler, flags=None, meta=_meta)
+            file_meta_data = {} if file_meta_data is None else file_meta_data
+            file_meta_data["no-main"] = "True"
+        block_meta = MetaData(file_meta_data) if file_meta_data is not None else None
+        if fence.limits is not None:
+            try:
+                _CPP_LIMITS.with_overrides(fence.limits)
+            except ValueError as e:
+                # the block still runs, with the limits every block has
+                report(fence.line, f"limits is ignored, {e}")
+            else:
+                block_meta = MetaData() if block_meta is None else block_meta
+                block_meta.data["limits"] = fence.limits
+        if not wants_to_run(fence.wants):
+            block_meta = MetaData() if block_meta is None else block_meta
+            block_meta.data["compile-only"] = "True"
+        if wants_compile_error(fence.wants):
+            # errors shown on the slide then point at the block, not a precompiled header
+            block_meta = MetaData() if block_meta is None else block_meta
+            block_meta.data["no-pch"] = "True"
+        blocks.append(CodeBlock(language=language, code=code, meta=block_meta, fence=fence))
+    return blocks
+
+def run_code_blocks(
+            blocks:Iterable[CodeBlock],
+            code_handler: CodeHandlerRegistry | None = None,
+            *, jobs:int = 1
+        ) -> list[CodeResult]:
+    """
+    Handle each code block, up to `jobs` at a time. Results are in the same order as the blocks.
+    Identical blocks are only handled once so no two jobs write the same build files.
+    """
+    blocks = list(blocks)
+    unique_blocks: dict[tuple[RuntimeLanguage, Code, str], CodeBlock] = {}
+    def key(block:CodeBlock) -> tuple[RuntimeLanguage, Code, str]:
+        return (block.language, block.code, repr(sorted(block.meta.data.items())) if block.meta is not None else "")
+    block_keys = [key(block) for block in blocks]
+    for block_key, block in zip(block_keys, blocks):
+        unique_blocks.setdefault(block_key, block)
+    registry: CodeHandlerRegistry = _DEFAULT_HANDLER if code_handler is None else code_handler
+    with _PROFILER.span("prepare code"):
+        registry.prepare_build(list(unique_blocks.values()))
+    def run(block:CodeBlock) -> CodeResult:
+        deck = block.meta.data.get("filename") if block.meta is not None else None
+        with _PROFILER.span("block", deck=deck, block=block.fence.line):
+            # flags are None for now, expected to be populated via regex
+            return handle_code(block.language, block.code, code_handler, flags=None, meta=block.meta)
+    try:
+        if jobs <= 1 or len(unique_blocks) <= 1:
+            results = [run(block) for block in unique_blocks.values()]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                # map returns (and raises) in submission order so errors stay deterministic
+                results = list(pool.map(run, unique_blocks.values()))
+    finally:
+        _RESULT_CACHE.save()
+    by_key = dict(zip(unique_blocks.keys(), results))
+    return [by_key[block_key] for block_key in block_keys]
+
+def substitute_code_results(
+            input:Markdown,
+            blocks:Iterable[CodeBlock],
+            results:Iterable[CodeResult],
+            meta:MetaData|None=None,
+        ) -> Markdown:
+    """
+    Replace the wants of each block with what its code does, blocks must be in the order they appear
+    """
+    return "".join(substituted_chunks(input, blocks, results, meta))
+
+def substituted_chunks(
+            input:Markdown,
+            blocks:Iterable[CodeBlock],
+            results:Iterable[CodeResult],
+            meta:MetaData|None=None,
+        ) -> list[str]:
+    """
+    substitute_code_results in pieces, for writing without joining them
+    """
+    output: list[str] = []
+    last_end = 0
+    for block, code_result in zip(blocks, results, strict=True):
+        wants_start, wants_end = block.fence.wants_span
         try:
-            reconstructed = reconstructed.replace(groups["outwants"], result_to_string(code_result, groups["outwants"]))
-            reconstructed = reconstructed.replace(groups["wantstag"], "does")
+            does = result_to_string(code_result, block.fence.wants)
         except Exception as e:
-            msg = "Could not process code block for file {file}\n code {code}"
-            if meta is not None: raise Exception(msg.format(file=meta.data.get('filename', 'unknown file'), code=code)) from e
+            msg = "Could not process code block (line {line}) for file {file}\n code {code}"
+            if meta is not None: raise Exception(msg.format(line=block.fence.line, file=meta.data.get('filename', 'unknown file'), code=block.code)) from e
             else: raise e
-        return reconstructed
-    
-    completed_block:str = _COMPILED_REGEX.sub(on_match, input)
-    if "wants=" in completed_block:
-        want_blocks = [ a for a in completed_block.splitlines() if "wants=" in a and "--" in a ]
-        print("Warning: Some code blocks were not processed.\n"
-              "\t Likely due to malformed element tag: order must be class, wants, id."
-              "\t Note code blocks CANNOT contain backticks")
-        print("Unprocessed blocks:\n", "\n\t".join(want_blocks))
-        if meta is not None: print(f"in file {meta.data.get('filename', 'unknown file')}")
-    return completed_block
-
-
-def template_file_setup(base_template_file:str, reveal_js_path:str) -> str:
-    with open(base_template_file, "r") as template_file:
-        return template_file.read().replace("@__REVEAL_JS_PATH__@", reveal_js_path)
-
-def fill_output_template(input_markdown:Markdown, template_file:HTML, output_file_name:str, *, title:str|None=None) -> None:
+        output.append(input[last_end:wants_start])
+        output.append(f'does="{does}"')
+        last_end = wants_end
+    output.append(input[last_end:])
+    return output
+
+def for_each_code_block(
+            input:Markdown,
+            meta:MetaData|None=None,
+            code_handler: CodeHandlerRegistry | None = None,
+            *, jobs:int = 1
+        ) -> Markdown:
+    blocks = collect_code_blocks(input, meta, code_handler)
+    results = run_code_blocks(blocks, code_handler, jobs=jobs)
+    return substitute_code_results(input, blocks, results, meta)
+
+
+# Pre-rendering, builds the html reveal.js's markdown and highlight plugins would otherwise make in every viewer's browser
+
+_SLIDE_SEPARATOR:Final = r"\r?\n---\r?\n"
+_VERTICAL_SLIDE_SEPARATOR:Final = r"^\[\/\/\].*\(Vertical slide\)"
+_SLIDE_SEPARATORS:Final = re.compile(_SLIDE_SEPARATOR + "|" + _VERTICAL_SLIDE_SEPARATOR, re.MULTILINE)
+_NOTES_SEPARATOR:Final = re.compile(r"^\s*notes?:", re.MULTILINE | re.IGNORECASE)
+
+def split_slides(markdown:Markdown) -> list[Markdown | list[Markdown]]:
+    """
+    Split markdown into slides the same way reveal.js does, vertical slides are grouped into a list
+    """
+    slides: list[Markdown | list[Markdown]] = []
+    last_end = 0
+    was_horizontal = True
+    for separator in _SLIDE_SEPARATORS.finditer(markdown):
+        is_horizontal = re.search(_SLIDE_SEPARATOR, separator.group()) is not None
+        if not is_horizontal and was_horizontal: slides.append([])
+        content = markdown[last_end:separator.start()]
+        if is_horizontal and was_horizontal: slides.append(content)
+        else: slides[-1].append(content) # type: ignore[union-attr]
+        last_end = separator.end()
+        was_horizontal = is_horizontal
+    (slides if was_horizontal else slides[-1]).append(markdown[last_end:]) # type: ignore[union-attr]
+    return slides
+
+_HTML_ESCAPES:Final = {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}
+_ESCAPE_ALL:Final = re.compile(r"[&<>\"']")
+_ESCAPE_TEXT:Final = re.compile(r"[<>\"']|&(?!#\d{1,7};|#[Xx][a-fA-F0-9]{1,6};|\w+;)")
+
+def escape_html(text:str, *, keep_entities:bool = False) -> HTML:
+    return (_ESCAPE_TEXT if keep_entities else _ESCAPE_ALL).sub(lambda match: _HTML_ESCAPES[match.group()], text)
+
+def _words(*words:str) -> str:
+    return r"\b(?:" + "|".join(words) + r")\b"
+
+# Group names are highlight.js's class names so its themes (monokai.css) colour the output
+_CPP_HIGHLIGHT:Final = re.compile("|".join((
+    r"(?P<comment>//[^\n]*|/\*[\s\S]*?(?:\*/|$))",
+    r"(?P<meta>^[ \t]*#[ \t]*[a-z]+(?:\\\n|[^\n])*)",
+    r"(?P<number>\b(?:0[xX][0-9a-fA-F']+|0[bB][01']+|\d[\d']*(?:\.\d*)?(?:[eE][+-]?\d+)?)[uUlLfFzZ]*\b)",
+    r"(?P<string>(?:\b(?:u8|[uUL]))?\"(?:[^\"\\\n]|\\.)*\"?|'(?:[^'\\\n]|\\.)*')",
+    r"(?P<literal>" + _words("true", "false", "nullptr", "NULL", "this") + ")",
+    r"(?P<type>" + _words("auto", "bool", "char", "char8_t", "char16_t", "char32_t", "double", "float", "int", "long",
+                         "short", "signed", "unsigned", "void", "wchar_t", "size_t", "int8_t", "int16_t", "int32_t",
+                         "int64_t", "uint8_t", "uint16_t", "uint32_t", "uint64_t") + ")",
+    r"(?P<keyword>" + _words("alignas", "alignof", "asm", "break", "case", "catch", "class", "concept", "const",
+                            "consteval", "constexpr", "constinit", "const_cast", "continue", "co_await", "co_return",
+                            "co_yield", "decltype", "default", "delete", "do", "dynamic_cast", "else", "enum",
+                            "explicit", "export", "extern", "final", "for", "friend", "goto", "if", "import",
+                            "inline", "module", "mutable", "namespace", "new", "noexcept", "operator", "override",
+                            "private", "protected", "public", "register", "reinterpret_cast", "requires", "restrict",
+                            "return", "sizeof", "static", "static_assert", "static_cast", "struct", "switch",
+                            "template", "thread_local", "throw", "try", "typedef", "typeid", "typename", "union",
+                            "using", "virtual", "volatile", "while") + ")",
+    r"(?P<built_in>" + _words("std", "string", "string_view", "vector", "array", "map", "set", "unordered_map",
+                             "unordered_set", "optional", "variant", "unique_ptr", "shared_ptr", "cout", "cerr",
+                             "endl", "printf", "malloc", "free", "memcpy", "memset", "assert") + ")",
+)), re.MULTILINE)
+
+_PYTHON_HIGHLIGHT:Final = re.compile("|".join((
+    r"(?P<comment>#[^\n]*)",
+    r"(?P<string>(?:\b[rRbBuUfF]{1,2})?(?:\"\"\"[\s\S]*?(?:\"\"\"|$)|'''[\s\S]*?(?:'''|$)|\"(?:[^\"\\\n]|\\.)*\"?|'(?:[^'\\\n]|\\.)*'?))",
+    r"(?P<meta>^[ \t]*@[\w.]+)",
+    r"(?P<number>\b(?:0[xX][0-9a-fA-F_]+|0[bB][01_]+|\d[\d_]*(?:\.\d*)?(?:[eE][+-]?\d+)?)[jJ]?\b)",
+    r"(?P<literal>" + _words("True", "False", "None") + ")",
+    r"(?P<keyword>" + _words("and", "as", "assert", "async", "await", "break", "class", "continue", "def", "del",
+                            "elif", "else", "except", "finally", "for", "from", "global", "if", "import", "in", "is",
+                            "lambda", "nonlocal", "not", "or", "pass", "raise", "return", "try", "while", "with",
+                            "yield") + ")",
+    r"(?P<built_in>" + _words("print", "len", "range", "open", "exit", "int", "str", "float", "list", "dict", "set",
+                             "tuple", "bool", "object", "type", "isinstance", "super", "enumerate", "zip", "map",
+                             "filter", "sorted", "sum", "min", "max", "abs", "repr", "iter", "next", "Exception") + ")",
+)), re.MULTILINE)
+
+_YAML_HIGHLIGHT:Final = re.compile("|".join((
+    r"(?P<comment>(?<!\S)#[^\n]*)",
+    r"(?P<bullet>^[ \t]*-(?=[ \t]|$))",
+    r"(?P<attr>[\w./-]+(?=[ \t]*:(?:[ \t]|$)))",
+    r"(?P<string>\"(?:[^\"\\\n]|\\.)*\"?|'[^'\n]*'?)",
+    r"(?P<number>(?<![\w-])\d+(?:\.\d+)?(?![\w-]))",
+    r"(?P<literal>" + _words("true", "false", "null", "yes", "no", "on", "off") + ")",
+)), re.MULTILINE)
+
+_HIGHLIGHTERS:Final[dict[str, re.Pattern[str]]] = {
+    "c++": _CPP_HIGHLIGHT, "cpp": _CPP_HIGHLIGHT, "cc": _CPP_HIGHLIGHT, "cxx": _CPP_HIGHLIGHT, "hpp": _CPP_HIGHLIGHT,
+    "h": _CPP_HIGHLIGHT, "c": _CPP_HIGHLIGHT,
+    "py": _PYTHON_HIGHLIGHT, "python": _PYTHON_HIGHLIGHT,
+    "yml": _YAML_HIGHLIGHT, "yaml": _YAML_HIGHLIGHT,
+}
+
+def highlight_code(code:Code, language:str) -> HTML:
+    """
+    Escape code and wrap its tokens in highlight.js's spans, spans never cross lines so lines can be numbered
+    """
+    highlighter = _HIGHLIGHTERS.get(language.lower())
+    if highlighter is None: return escape_html(code)
+    output: list[str] = []
+    last_end = 0
+    for token in highlighter.finditer(code):
+        if token.start() == token.end(): continue
+        output.append(escape_html(code[last_end:token.start()]))
+        span = f'<span class="hljs-{token.lastgroup}">'
+        output.append("\n".join(span + escape_html(line) + "</span>" if line else "" for line in token.group().split("\n")))
+        last_end = token.end()
+    output.append(escape_html(code[last_end:]))
+    return "".join(output)
+
+_CODE_LINE_NUMBERS:Final = re.compile(r"\[\s*((\d*):)?\s*([\s\d,|-]*)\]")
+
+def _highlight_steps(line_numbers:str) -> list[list[tuple[int, int]]]:
+    """Parse reveal.js's `1|2-4,6` line highlight steps"""
+    steps: list[list[tuple[int, int]]] = []
+    for step in line_numbers.replace(" ", "").split("|"):
+        ranges: list[tuple[int, int]] = []
+        for line_range in filter(None, step.split(",")):
+            start, _, end = line_range.partition("-")
+            if start.isdigit(): ranges.append((int(start), int(end) if end.isdigit() else int(start)))
+        steps.append(ranges)
+    return steps
+
+def render_code_block(code:Code, info:str) -> HTML:
+    """
+    Render a fenced code block like reveal.js's markdown plugin, highlighted and with line numbers like its highlight plugin
+    """
+    language = info.strip()
+    line_numbers = _CODE_LINE_NUMBERS.search(language)
+    if line_numbers is None:
+        return f'<pre><code class="{escape_html(language)} hljs">{highlight_code(code, language.split(" ")[0])}</code></pre>\n'
+    start_from = int(line_numbers.group(2)) if line_numbers.group(2) else 1
+    steps = line_numbers.group(3).strip()
+    language = _CODE_LINE_NUMBERS.sub("", language).strip()
+    lines = highlight_code(code, language).split("\n")
+    if len(lines) > 1 and lines[-1].strip() == "": lines.pop()
+    def numbered(step:str, highlights:list[tuple[int, int]], extra_class:str) -> HTML:
+        highlighted = {line for start, end in highlights for line in range(start, end + 1) if line <= len(lines)}
+        rows = "".join(
+            ('<tr class="highlight-line">' if index in highlighted else "<tr>") +
+            f'<td class="hljs-ln-line hljs-ln-numbers" data-line-number="{number}"><div class="hljs-ln-n" data-line-number="{number}"></div></td>'
+            f'<td class="hljs-ln-line hljs-ln-code" data-line-number="{number}">{line if line else " "}</td></tr>'
+            for index, (number, line) in enumerate(((start_from + index, line) for index, line in enumerate(lines)), start=1))
+        classes = " ".join(filter(None, (escape_html(language), "hljs", "has-highlights" if highlighted else "", extra_class)))
+        return f'<code data-line-numbers="{step}" class="{classes}"><table class="hljs-ln">{rows}</table></code>'
+    # Every step after the first is a fragment that replaces the block before it
+    step_strings = steps.replace(" ", "").split("|")
+    blocks = [numbered(step, highlights, "" if index == 0 else "fragment")
+              for index, (step, highlights) in enumerate(zip(step_strings, _highlight_steps(steps)))]
+    return f"<pre>{''.join(blocks)}</pre>\n"
+
+_INLINE_PATTERN:Final = re.compile("|".join((
+    r"(?P<escape>\\[!-/:-@\[-`{-~])",
+    r"(?P<code>(?P<ticks>`+)(?P<code_text>[\s\S]*?[^`])(?P=ticks)(?!`))",
+    r"(?P<autolink><(?P<autolink_url>[a-zA-Z][a-zA-Z0-9+.-]{1,31}:[^\s<>]*)>)",
+    r"(?P<html><!--[\s\S]*?-->|</?[a-zA-Z][\w-]*(?:\s+[a-zA-Z_:][\w.:-]*(?:\s*=\s*(?:[^\s\"'=<>`]+|'[^']*'|\"[^\"]*\"))?)*\s*/?>)",
+    r"(?P<image>!\[(?P<image_alt>[^\]]*)\]\((?P<image_src>[^\s)]*)(?:\s+\"(?P<image_title>[^\"]*)\")?\))",
+    r"(?P<link>\[(?P<link_text>(?:\[[^\]]*\]|[^\[\]])*)\]\((?P<link_href>[^\s)]*)(?:\s+\"(?P<link_title>[^\"]*)\")?\))",
+    r"(?P<strong>\*\*(?=\S)(?P<strong_text>[\s\S]*?\S)\*\*(?!\*)|(?<!\w)__(?=\S)(?P<underscore_strong_text>[\s\S]*?\S)__(?!\w))",
+    r"(?P<em>\*(?=[^\s*])(?P<em_text>[\s\S]*?[^\s*])\*(?!\*)|(?<!\w)_(?=\S)(?P<underscore_em_text>[\s\S]*?\S)_(?!\w))",
+    r"(?P<strike>~~(?=\S)(?P<strike_text>[\s\S]*?\S)~~)",
+    r"(?P<url>https?://[^\s<]*[^\s<?!.,:*_~)'\"])",
+    r"(?P<line_break>(?: {2,}|\\)\n)",
+)))
+
+def _render_inline(text:Markdown) -> HTML:
+    output: list[str] = []
+    last_end = 0
+    for token in _INLINE_PATTERN.finditer(text):
+        output.append(escape_html(text[last_end:token.start()], keep_entities=True))
+        last_end = token.end()
+        match token.lastgroup:
+            case "escape": output.append(escape_html(token.group()[1]))
+            case "code":
+                code = token.group("code_text").replace("\n", " ")
+                if code.startswith(" ") and code.endswith(" ") and code.strip(): code = code[1:-1]
+                output.append(f"<code>{escape_html(code)}</code>")
+            case "autolink":
+                url = escape_html(token.group("autolink_url"))
+                output.append(f'<a href="{url}">{url}</a>')
+            case "html": output.append(token.group())
+            case "image":
+                title = f' title="{escape_html(token.group("image_title"))}"' if token.group("image_title") is not None else ""
+                output.append(f'<img src="{escape_html(token.group("image_src"), keep_entities=True)}" alt="{escape_html(token.group("image_alt"))}"{title}>')
+            case "link":
+                title = f' title="{escape_html(token.group("link_title"))}"' if token.group("link_title") is not None else ""
+                href = token.group("link_href").removeprefix("<").removesuffix(">")
+                output.append(f'<a href="{escape_html(href, keep_entities=True)}"{title}>{_render_inline(token.group("link_text"))}</a>')
+            case "strong":
+                output.append(f"<strong>{_render_inline(token.group('strong_text') or token.group('underscore_strong_text'))}</strong>")
+            case "em":
+                output.append(f"<em>{_render_inline(token.group('em_text') or token.group('underscore_em_text'))}</em>")
+            case "strike": output.append(f"<del>{_render_inline(token.group('strike_text'))}</del>")
+            case "url": output.append(f'<a href="{escape_html(token.group(), keep_entities=True)}">{escape_html(token.group(), keep_entities=True)}</a>')
+            case _: output.append("<br>")
+    output.append(escape_html(text[last_end:], keep_entities=True))
+    return "".join(output)
+
+_FENCE:Final = re.compile(r"^( {0,3})(`{3,}|~{3,})(.*)$")
+_HEADING:Final = re.compile(r"^ {0,3}(#{1,6})(?=[ \t]|$)[ \t]*(.*?)(?:[ \t]+#+)?[ \t]*$")
+_SETEXT_UNDERLINE:Final = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+_THEMATIC_BREAK:Final = re.compile(r"^ {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$")
+_BLOCKQUOTE:Final = re.compile(r"^ {0,3}> ?")
+_LIST_ITEM:Final = re.compile(r"^( {0,3})([*+-]|\d{1,9}[.)])([ \t]+|$)")
+_TABLE_DELIMITER:Final = re.compile(r"^ {0,3}\|?[ \t]*:?-+:?[ \t]*(?:\|[ \t]*:?-+:?[ \t]*)*\|?[ \t]*$")
+_HTML_BLOCK_TAGS:Final = ("address|article|aside|base|basefont|blockquote|body|caption|center|col|colgroup|dd|details|dialog|dir|div"
+                          "|dl|dt|fieldset|figcaption|figure|footer|form|frame|frameset|h[1-6]|head|header|hr|html|iframe|legend|li"
+                          "|link|main|menu|menuitem|meta|nav|noframes|ol|optgroup|option|p|param|section|source|summary|table"
+                          "|tbody|td|tfoot|th|thead|title|tr|track|ul")
+_HTML_BLOCK:Final = re.compile(r"^ {0,3}(?:(?P<comment><!--)|<(?P<raw>script|pre|style|textarea)(?=[\s>]|$)|</?(?:" + _HTML_BLOCK_TAGS + r")(?=[\s/>]|$))", re.IGNORECASE)
+_HTML_LONE_TAG:Final = re.compile(r"^ {0,3}(?:<[a-zA-Z][\w-]*(?:\s+[a-zA-Z_:][\w.:-]*(?:\s*=\s*(?:[^\s\"'=<>`]+|'[^']*'|\"[^\"]*\"))?)*\s*/?>|</[a-zA-Z][\w-]*\s*>)[ \t]*$")
+
+def _starts_block(line:str) -> bool:
+    """If line starts a block that ends the paragraph before it"""
+    list_item = _LIST_ITEM.match(line)
+    return (_FENCE.match(line) is not None or _HEADING.match(line) is not None or _THEMATIC_BREAK.match(line) is not None
+            or _BLOCKQUOTE.match(line) is not None or _HTML_BLOCK.match(line) is not None
+            or (list_item is not None and list_item.group(3) != "" and list_item.group(2) in ("*", "+", "-", "1.", "1)")))
+
+def _starts_table(lines:list[str], index:int) -> bool:
+    return "|" in lines[index] and index + 1 < len(lines) and _TABLE_DELIMITER.match(lines[index + 1]) is not None
+
+def _split_table_row(row:str) -> list[str]:
+    row = row.strip().removeprefix("|")
+    if row.endswith("|") and not row.endswith("\\|"): row = row[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in re.split(r"(?<!\\)\|", row)]
+
+def _render_table(lines:list[str]) -> HTML | None:
+    header = _split_table_row(lines[0])
+    aligns = [' align="center"' if cell.startswith(":") and cell.endswith(":") else ' align="right"' if cell.endswith(":")
+              else ' align="left"' if cell.startswith(":") else "" for cell in _split_table_row(lines[1])]
+    if len(header) != len(aligns): return None
+    head = "".join(f"<th{align}>{_render_inline(cell)}</th>\n" for cell, align in zip(header, aligns))
+    rows = "".join("<tr>\n" + "".join(f"<td{align}>{_render_inline(cell)}</td>\n" for cell, align in zip(cells + [""] * len(aligns), aligns)) + "</tr>\n"
+                   for cells in map(_split_table_row, lines[2:]))
+    return f"<table>\n<thead>\n<tr>\n{head}</tr>\n</thead>\n<tbody>{rows}</tbody></table>\n"
+
+def _render_heading(level:int, text:Markdown, slugs:dict[str, int]) -> HTML:
+    """A heading with the id marked (reveal.js's markdown parser) would give it, so links to it work the same"""
+    inner = _render_inline(text)
+    plain_text = html.unescape(re.sub(r"<[^>]*>", "", inner)).lower().strip()
+    slug = re.sub(r"\s", "-", re.sub(r"[\u2000-\u206F\u2E00-\u2E7F\\'!\"#$%&()*+,./:;<=>?@\[\]^`{|}~]", "", plain_text))
+    original_slug = slug
+    while slug in slugs:
+        slugs[original_slug] += 1
+        slug = f"{original_slug}-{slugs[original_slug]}"
+    slugs[slug] = 0
+    return f'<h{level} id="{slug}">{inner}</h{level}>\n'
+
+def _render_list(lines:list[str], index:int, slugs:dict[str, int]) -> tuple[HTML, int]:
+    """Render the list starting at lines[index], returns it and the index of the line after it"""
+    first_item = _LIST_ITEM.match(lines[index])
+    assert first_item is not None
+    marker = first_item.group(2)[-1]
+    items: list[list[str]] = []
+    loose = False
+    while index < len(lines) and (item := _LIST_ITEM.match(lines[index])) is not None and item.group(2)[-1] == marker:
+        if loose is False and items and lines[index - 1].strip() == "": loose = True
+        spacing = len(item.group(3).expandtabs(4))
+        content_indent = len(item.group(1)) + len(item.group(2)) + (spacing if 1 <= spacing <= 4 else 1)
+        item_lines = [lines[index][item.end():]]
+        index += 1
+        while index < len(lines):
+            line = lines[index].expandtabs(4)
+            if not line.strip(): item_lines.append("")
+            elif len(line) - len(line.lstrip(" ")) >= content_indent: item_lines.append(line[content_indent:])
+            # the next item of this list, even one that could not interrupt a paragraph elsewhere (e.g. "2.")
+            elif (sibling := _LIST_ITEM.match(line)) is not None and sibling.group(2)[-1] == marker: break
+            elif item_lines[-1] and not _starts_block(line): item_lines.append(line.lstrip(" "))  # lazy continuation of a paragraph
+            else: break
+            index += 1
+        while len(item_lines) > 1 and not item_lines[-1]: item_lines.pop()
+        # blank lines between an item's own blocks make the whole list loose
+        in_fence = False
+        for previous_line, line in zip(item_lines, item_lines[1:]):
+            if _FENCE.match(line): in_fence = not in_fence
+            if not in_fence and not previous_line and line and not line.startswith(" ") and _LIST_ITEM.match(line) is None: loose = True
+        items.append(item_lines)
+    # blank lines after the last item belong to whatever comes next
+    while not lines[index - 1].strip(): index -= 1
+    tag = "ul" if marker in "*+-" else "ol"
+    start = int(first_item.group(2)[:-1]) if tag == "ol" else 1
+    start_attribute = f' start="{start}"' if start != 1 else ""
+    rendered_items = "".join(f"<li>{_render_blocks(item_lines, slugs, tight=not loose)}</li>\n" for item_lines in items)
+    return f"<{tag}{start_attribute}>\n{rendered_items}</{tag}>\n", index
+
+def _render_blocks(lines:list[str], slugs:dict[str, int], *, tight:bool = False) -> HTML:
+    """Render markdown (as lines) to html, tight leaves paragraphs unwrapped as in list items without blank lines"""
+    output: list[str] = []
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if not line.strip():
+            index += 1
+            continue
+        if (fence := _FENCE.match(line)) is not None and not (fence.group(2)[0] == "`" and "`" in fence.group(3)):
+            indent, marker = len(fence.group(1)), fence.group(2)
+            closing = re.compile(rf"^ {{0,3}}{re.escape(marker[0])}{{{len(marker)},}}[ \t]*$")
+            end = next((end for end in range(index + 1, len(lines)) if closing.match(lines[end])), len(lines))
+            code = "\n".join(re.sub(rf"^ {{0,{indent}}}", "", code_line) for code_line in lines[index + 1:end])
+            output.append(render_code_block(code, fence.group(3)))
+            index = end + 1
+            continue
+        if (heading := _HEADING.match(line)) is not None:
+            output.append(_render_heading(len(heading.group(1)), heading.group(2), slugs))
+            index += 1
+            continue
+        if _THEMATIC_BREAK.match(line):
+            output.append("<hr>\n")
+            index += 1
+            continue
+        if _BLOCKQUOTE.match(line):
+            end = next((end for end in range(index, len(lines)) if not lines[end].strip()), len(lines))
+            quoted = [_BLOCKQUOTE.sub("", quoted_line, count=1) for quoted_line in lines[index:end]]
+            output.append(f"<blockquote>\n{_render_blocks(quoted, slugs)}</blockquote>\n")
+            index = end
+            continue
+        if _LIST_ITEM.match(line):
+            rendered_list, index = _render_list(lines, index, slugs)
+            output.append(rendered_list)
+            continue
+        if (html_block := _HTML_BLOCK.match(line)) is not None or _HTML_LONE_TAG.match(line):
+            if html_block is not None and html_block.group("comment"):
+                ends = ("-->" in lines[end] for end in range(index, len(lines)))
+            elif html_block is not None and html_block.group("raw"):
+                ends = (f"</{html_block.group('raw').lower()}>" in lines[end].lower() for end in range(index, len(lines)))
+            else:
+                ends = (end + 1 == len(lines) or not lines[end + 1].strip() for end in range(index, len(lines)))
+            end = index + next((offset for offset, is_end in enumerate(ends) if is_end), len(lines) - 1 - index)
+            output.append("\n".join(lines[index:end + 1]) + "\n")
+            index = end + 1
+            continue
+        if _starts_table(lines, index):
+            end = next((end for end in range(index + 2, len(lines)) if not lines[end].strip() or _starts_block(lines[end])), len(lines))
+            if (table := _render_table(lines[index:end])) is not None:
+                output.append(table)
+                index = end
+                continue
+        end = index + 1
+        heading_level = 0
+        while end < len(lines) and lines[end].strip():
+            if (underline := _SETEXT_UNDERLINE.match(lines[end])) is not None:
+                heading_level = 1 if underline.group(1).startswith("=") else 2
+                break
+            if _starts_block(lines[end]) or _starts_table(lines, end): break
+            end += 1
+        text = "\n".join(paragraph_line.lstrip() for paragraph_line in lines[index:end]).rstrip()
+        if heading_level:
+            output.append(_render_heading(heading_level, text, slugs))
+            index = end + 1
+            continue
+        output.append(_render_inline(text) if tight else f"<p>{_render_inline(text)}</p>\n")
+        index = end
+    return "".join(output)
+
+def render_markdown(markdown:Markdown) -> HTML:
+    """
+    Render markdown to html like the marked library reveal.js uses (GitHub flavoured, raw html passed through)
+    """
+    return _render_blocks(markdown.replace("\r\n", "\n").split("\n"), {})
+
+_VOID_ELEMENTS:Final = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"})
+_ELEMENT_ATTRIBUTES:Final = re.compile(r"\.element\s*?(.+?)$", re.MULTILINE)
+_SLIDE_ATTRIBUTES:Final = re.compile(r"\.slide:\s*?(\S.+?)$", re.MULTILINE)
+_ATTRIBUTE:Final = re.compile(r"([^\"= ]+?)=\"([^\"]+?)\"|(data-[^\"= ]+?)(?=[\" ])")
+
+@dataclass
+class _Comment:
+    text: str
+
+    def __str__(self) -> HTML:
+        return f"<!--{self.text}-->"
+
+@dataclass
+class _Element:
+    tag: str
+    attributes: dict[str, str | None]
+    start_tag: str | None # as written, so untouched elements come out exactly as they went in
+    self_closing: bool = False
+    children: list["_Element | _Comment | str"] = dataclasses.field(default_factory=list)
+
+    def set_attribute(self, name:str, value:str) -> None:
+        self.attributes[name.lower()] = value
+        self.start_tag = None
+
+    def __str__(self) -> HTML:
+        start_tag = self.start_tag if self.start_tag is not None else "<" + self.tag + "".join(
+            f" {name}" if value is None else f' {name}="{escape_html(value)}"'
+            for name, value in self.attributes.items()) + ">"
+        if self.self_closing or self.tag in _VOID_ELEMENTS: return start_tag
+        return start_tag + "".join(map(str, self.children)) + f"</{self.tag}>"
+
+class _SlideParser(html.parser.HTMLParser):
+    """
+    Parse a slide's html into elements, like the browser does before reveal.js moves attributes out of comments
+    """
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.section = _Element("section", {}, "<section>")
+        self.open_elements: list[_Element] = [self.section]
+
+    @override
+    def handle_starttag(self, tag:str, attrs:list[tuple[str, str | None]]) -> None:
+        element = _Element(tag, dict(attrs), self.get_starttag_text())
+        self.open_elements[-1].children.append(element)
+        if tag not in _VOID_ELEMENTS: self.open_elements.append(element)
+
+    @override
+    def handle_startendtag(self, tag:str, attrs:list[tuple[str, str | None]]) -> None:
+        self.open_elements[-1].children.append(_Element(tag, dict(attrs), self.get_starttag_text(), self_closing=True))
+
+    @override
+    def handle_endtag(self, tag:str) -> None:
+        # close everything left open inside it, unmatched end tags are dropped
+        for depth in range(len(self.open_elements) - 1, 0, -1):
+            if self.open_elements[depth].tag == tag:
+                del self.open_elements[depth:]
+                return
+
+    @override
+    def handle_data(self, data:str) -> None: self.open_elements[-1].children.append(data)
+    @override
+    def handle_entityref(self, name:str) -> None: self.open_elements[-1].children.append(f"&{name};")
+    @override
+    def handle_charref(self, name:str) -> None: self.open_elements[-1].children.append(f"&#{name};")
+    @override
+    def handle_comment(self, data:str) -> None: self.open_elements[-1].children.append(_Comment(data))
+    @override
+    def handle_decl(self, decl:str) -> None: self.open_elements[-1].children.append(f"<!{decl}>")
+
+def _move_attributes(comment:_Comment, element:_Element, pattern:re.Pattern[str]) -> bool:
+    match = pattern.search(comment.text)
+    if match is None: return False
+    comment.text = comment.text[:match.start()] + comment.text[match.end():]
+    for name, value, flag in _ATTRIBUTE.findall(match.group(1)):
+        if value: element.set_attribute(name, value)
+        else: element.set_attribute(flag, "")
+    return True
+
+def _apply_element_attributes(section:_Element, element:_Element) -> None:
+    """
+    Comments give their attributes to the element before them (or their parent if first), else to their slide
+    """
+    target = element
+    for child in element.children:
+        if isinstance(child, _Comment):
+            if not _move_attributes(child, target, _ELEMENT_ATTRIBUTES): _move_attributes(child, section, _SLIDE_ATTRIBUTES)
+        elif isinstance(child, _Element):
+            _apply_element_attributes(child if child.tag == "section" else section, child)
+            if child.tag != "br": target = child
+
+def _mark_code_wrappers(element:_Element) -> None:
+    """reveal.js's highlight plugin styles `pre`s holding code with this class"""
+    for child in element.children:
+        if not isinstance(child, _Element): continue
+        if child.tag == "pre" and any(isinstance(code, _Element) and code.tag == "code" for code in child.children):
+            child.set_attribute("class", " ".join(filter(None, (child.attributes.get("class"), "code-wrapper"))))
+        _mark_code_wrappers(child)
+
+def render_slide(markdown:Markdown) -> HTML:
+    """
+    Render one slide to the `<section>` reveal.js would make of it, with speaker notes and comment attributes applied
+    """
+    parts = _NOTES_SEPARATOR.split(markdown)
+    if len(parts) == 2: rendered = render_markdown(parts[0]) + f'<aside class="notes">{render_markdown(parts[1].strip())}</aside>'
+    else: rendered = render_markdown(markdown)
+    parser = _SlideParser()
+    parser.feed(rendered)
+    parser.close()
+    _apply_element_attributes(parser.section, parser.section)
+    _mark_code_wrappers(parser.section)
+    return str(parser.section)
+
+def render_slides(markdown:Markdown) -> HTML:
+    """
+    Render a whole deck to slides, vertical slides are nested in a section of their own
+    """
+    sections: list[HTML] = []
+    for slide in split_slides(markdown):
+        if isinstance(slide, list): sections.append("<section>\n" + "\n".join(map(render_slide, slide)) + "\n</section>")
+        else: sections.append(render_slide(slide))
+    return "\n".join(sections)
+
+
+_TEMPLATE_PLACEHOLDER:Final = re.compile(r"@__(?:REVEAL_JS_PATH|MARKDOWN INPUT|SLIDES|TITLE)__@")
+
+@dataclass(frozen=True)
+class OutputTemplate:
+    """
+    A template split into its text and the placeholders between, so filling it in never copies the page.
+    Segments alternate text and placeholder, starting and ending with text.
+    """
+    segments: tuple[str, ...]
+
+    @staticmethod
+    def parse(text:HTML) -> "OutputTemplate":
+        segments: list[str] = []
+        last_end = 0
+        for placeholder in _TEMPLATE_PLACEHOLDER.finditer(text):
+            segments += (text[last_end:placeholder.start()], placeholder.group())
+            last_end = placeholder.end()
+        segments.append(text[last_end:])
+        return OutputTemplate(tuple(segments))
+
+    def __contains__(self, placeholder:str) -> bool:
+        return placeholder in self.segments[1::2]
+
+    def fill(self, placeholder:str, value:str) -> "OutputTemplate":
+        """
+        The template with placeholder replaced by value, for values every deck shares
+        """
+        segments = [self.segments[0]]
+        for index in range(1, len(self.segments), 2):
+            if self.segments[index] == placeholder: segments[-1] += value + self.segments[index + 1]
+            else: segments += (self.segments[index], self.segments[index + 1])
+        return OutputTemplate(tuple(segments))
+
+    def chunks(self, values:dict[str, Iterable[str]]) -> Iterator[str]:
+        """
+        The filled in template a piece at a time, placeholders without a value are left in
+        """
+        for index, segment in enumerate(self.segments):
+            if index % 2 == 0 or segment not in values: yield segment
+            else: yield from values[segment]
+
+@functools.lru_cache(maxsize=8)
+def _load_template(file_name:str, modified:int, reveal_js_path:str) -> OutputTemplate:
+    with open(file_name, "r") as template_file:
+        return OutputTemplate.parse(template_file.read()).fill("@__REVEAL_JS_PATH__@", reveal_js_path)
+
+def template_file_setup(base_template_file:str, reveal_js_path:str) -> OutputTemplate:
+    """
+    Read and split the template once, it is read again only once it changes
+    """
+    return _load_template(base_template_file, os.stat(base_template_file).st_mtime_ns, reveal_js_path)
+
+_PRERENDER_TEMPLATE:Final = "TemplateSlides.static.html.in"
+
+def fill_output_template(input_markdown:Markdown|Iterable[str], template:OutputTemplate, output_file_name:str, *, title:str|None=None, prerender:bool=False) -> None:
+    """
+    Write the filled in template a piece at a time, the markdown can be given as pieces too.
+    prerender puts finished slides in `@__SLIDES__@` instead of markdown for the browser to render
+    """
     title = title if title is not None else output_file_name.rsplit(".", 1)[0]
-    with open(output_file_name, "w") as out_file:
-        out_file.write(
-            template_file.replace("@__MARKDOWN INPUT__@", input_markdown) # fill in markdown
-            .replace("@__TITLE__@", title)   # give it a good title
-        )
+    markdown = (input_markdown,) if isinstance(input_markdown, str) else input_markdown
+    values: dict[str, Iterable[str]] = {"@__TITLE__@": (title,)}
+    if prerender:
+        if "@__SLIDES__@" not in template: raise Exception(f"Cannot pre-render {output_file_name}, template has no @__SLIDES__@ to put slides in (see {_PRERENDER_TEMPLATE})")
+        with _PROFILER.span("template"):
+            values["@__SLIDES__@"] = (render_slides("".join(markdown)),)
+    else: values["@__MARKDOWN INPUT__@"] = markdown
+    with _PROFILER.span("write"), open(output_file_name, "w") as out_file:
+        out_file.writelines(template.chunks(values))
 
 def _get_git_path() -> str:
     if try_executable("git"): return "git"
     if (path_ := find_executable("git")) is not None: return path_
     raise RuntimeError("Could not find git executable")
 
-_GIT_PATH = _get_git_path()
+@functools.cache
+def get_git_path() -> str:
+    return _discover("git", _get_git_path)
 
 def _clone_reveal_js(*, 
         destination_folder:str = "build/reveal_js",
@@ -400,7 +2219,7 @@ def _clone_reveal_js(*,
     # We only need "css", "dist", "plugin" folders
     #  TODO: Only Get required folders
     clone = subprocess.run(
-        (_GIT_PATH, "clone", "-b", version_tag, "-q", "--depth", "1", "--single-branch", repo_url , destination_folder),
+        (get_git_path(), "clone", "-b", version_tag, "-q", "--depth", "1", "--single-branch", repo_url , destination_folder),
         stderr=subprocess.PIPE
     )
     if clone.returncode == 0:
@@ -408,37 +2227,125 @@ def _clone_reveal_js(*,
     print(f"Could not clone reveal.js, got {clone.stderr}, using CDN instead")
     return f"https://cdnjs.cloudflare.com/ajax/libs/reveal.js/{version_tag}/"
 
-_REVEAL_JS_PATH:Final = _clone_reveal_js()
+@functools.cache
+def get_reveal_js_path() -> str:
+    """
+    Only cloned once a deck is written without a reveal.js path
+    """
+    return _clone_reveal_js()
+
 _IGNORE_FILE_STRING = "<!-- .ignore -->"
 
-def create_markdown_data(input_file_name:str) -> Markdown|None:
+def read_markdown_file(input_file_name:str) -> Markdown|None:
     with open(input_file_name, "r") as in_file:
         markdown_file_data = in_file.read()
     if (markdown_file_data[0:len(_IGNORE_FILE_STRING)] == _IGNORE_FILE_STRING):
         return None
-    meta = MetaData()
-    meta.data.update({"filename": clean_link(input_file_name)})
-    return for_each_code_block(markdown_file_data, meta=meta)
+    return markdown_file_data
+
+def create_file_meta(input_file_name:str) -> MetaData:
+    return MetaData({"filename": clean_link(input_file_name)})
 
-def prepend_markdown_file(file_name_to_prepend:str|None, markdown_data:Markdown, *, new_slide:str="---") -> Markdown:
+@dataclass
+class Deck:
+    input_file: str
+    markdown: Markdown
+    meta: MetaData
+    blocks: list[CodeBlock]
+    inputs_hash: str = ""
+
+def hash_file(file_name:str|None) -> str | None:
+    if file_name is None: return None
+    with open(file_name, "rb") as in_file:
+        return hashlib.file_digest(in_file, "sha256").hexdigest()
+
+def _toolchain_identity(language:str) -> str:
+    match language:
+        case "cpp": return _compiler_identity(get_cpp_compiler())
+        case "python": return sys.version
+        case _: return ""
+
+class BuildGraph:
+    """
+    What each output html was built from, so decks whose inputs have not changed are not built again.
+    Inputs are a hash of the markdown, template, begin/end slides and settings,
+    plus the toolchain of each language the deck has code blocks in.
+    """
+    _VERSION:Final = 1
+
+    def __init__(self, path:str = "build/build_graph.json") -> None:
+        self.path = path
+        self._outputs: dict[str, dict[str, Any]] = {}
+        self._index: list[str] | None = None
+        try:
+            with open(path, "r") as graph_file:
+                graph = json.load(graph_file)
+            if graph.get("version") == self._VERSION:
+                self._outputs = graph["outputs"]
+                self._index = graph["index"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def inputs_hash(markdown:Markdown, settings:Iterable[object]) -> str:
+        return ResultCache.create_key(hashlib.sha256(markdown.encode("utf-8")).hexdigest(), list(settings))
+
+    def is_up_to_date(self, output_file:str, inputs_hash:str) -> bool:
+        entry = self._outputs.get(output_file)
+        if entry is None or entry["inputs"] != inputs_hash or not os.path.exists(output_file): return False
+        return all(_toolchain_identity(language) == identity for language, identity in entry["toolchains"].items())
+
+    def record(self, output_file:str, inputs_hash:str, blocks:Iterable[CodeBlock], results:Iterable[CodeResult]) -> None:
+        # a time out may not happen next time, so build it again
+        if any(result.timed_out for result in results):
+            self._outputs.pop(output_file, None)
+            return
+        languages = {str(block.language) for block in blocks}
+        self._outputs[output_file] = {"inputs": inputs_hash, "toolchains": {language: _toolchain_identity(language) for language in sorted(languages)}}
+
+    def index_is_up_to_date(self, to_link_to:Iterable[str]) -> bool:
+        return self._index == sorted(to_link_to) and os.path.exists("index.html")
+
+    def record_index(self, to_link_to:Iterable[str]) -> None:
+        self._index = sorted(to_link_to)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as graph_file:
+            json.dump({"version": self._VERSION, "outputs": self._outputs, "index": self._index}, graph_file)
+        os.replace(temp_path, self.path)
+
+def create_markdown_data(input_file_name:str, *, jobs:int = 1) -> Markdown|None:
+    markdown_file_data = read_markdown_file(input_file_name)
+    if markdown_file_data is None: return None
+    return for_each_code_block(markdown_file_data, meta=create_file_meta(input_file_name), jobs=jobs)
+
+@functools.lru_cache(maxsize=8)
+def _read_slide_file(file_name:str, modified:int) -> Markdown:
+    with open(file_name) as slide_file:
+        return slide_file.read()
+
+def prepend_markdown_file(file_name_to_prepend:str|None, markdown_data:list[str], *, new_slide:str="---") -> list[str]:
+    """
+    Markdown is in pieces so every deck can share the begin slide instead of copying it, and the deck, each time
+    """
     if file_name_to_prepend is None: return markdown_data
-    with open(file_name_to_prepend) as prepend_file:
-        prepend_data = prepend_file.read()
-    return prepend_data + "\n" + new_slide + "\n" + markdown_data
+    return [_read_slide_file(file_name_to_prepend, os.stat(file_name_to_prepend).st_mtime_ns), "\n" + new_slide + "\n", *markdown_data]
 
-def append_markdown_file(file_name_to_append:str|None, markdown_data:Markdown, *, new_slide:str="---") -> Markdown:
+def append_markdown_file(file_name_to_append:str|None, markdown_data:list[str], *, new_slide:str="---") -> list[str]:
     if file_name_to_append is None: return markdown_data
-    with open(file_name_to_append) as append_file:
-        append_data = append_file.read()
-    return markdown_data + "\n" + new_slide + "\n" + append_data
+    return [*markdown_data, "\n" + new_slide + "\n", _read_slide_file(file_name_to_append, os.stat(file_name_to_append).st_mtime_ns)]
 
 def create_html_file(
-        markdown_data:Markdown, output_file_name:str, input_file_name:str, *, 
+        markdown_data:Markdown|Iterable[str], output_file_name:str, input_file_name:str, *, 
         template_file_name:str = "TemplateSlides.html.in",
-        reveal_js_path:str = _REVEAL_JS_PATH
+        reveal_js_path:str|None = None,
+        prerender:bool = False
     ) -> None:
-    template_half_filled = template_file_setup(template_file_name, reveal_js_path)
-    fill_output_template(markdown_data, template_half_filled, output_file_name, title=input_file_name.rsplit(".", 1)[0])
+    reveal_js_path = get_reveal_js_path() if reveal_js_path is None else reveal_js_path
+    template = template_file_setup(template_file_name, reveal_js_path)
+    fill_output_template(markdown_data, template, output_file_name, title=input_file_name.rsplit(".", 1)[0], prerender=prerender)
 
 _HTML ="""<html>
     <body>
@@ -457,40 +2364,486 @@ def create_contents_index(to_link_to:Iterable[str]) -> None:
     with open("index.html", "w") as index_file:
         index_file.write(_HTML.format(links_str=links_str))
 
-def main() -> None:
-    import argparse
-    arg_parser = argparse.ArgumentParser(prog="Rayveal.js.py", description="Create slides from markdown file with code blocks that can be compiled and executed.", add_help=True)
-    arg_parser.add_argument("input_files", metavar="input_markdown_files", type=str, nargs="+", help="markdown files to process, wildcards are allowed")
-    arg_parser.add_argument("-t", "--template", type=str, default="TemplateSlides.html.in", help="Specify the template file to use. Default is TemplateSlides.html.in")
-    arg_parser.add_argument("-o", "--output-prefix", type=str, default="", help="Specify the output folder name.\n Default is this folder")
-    arg_parser.add_argument("-r", "--reveal-js-path", type=str, default=_REVEAL_JS_PATH, help="Path to reveal.js folder.\n Defaults to cloning the reveal.js repo in build/reveal_js.")
-    arg_parser.add_argument("-i", "--ignore", type=str, default="", help="glob pattern of files to ignore, useful for READMEs, defaults to nothing")
-    arg_parser.add_argument("-n", "--no-index", action="store_true", help="If a contents index should be (re/)created, defaults to creating one")
-    arg_parser.add_argument("-e", "--end-slide", type=str, default=None, help="A markdown file to append to the end of each created slide deck, useful for contact info etc.")
-    arg_parser.add_argument("-b", "--begin-slide", type=str, default=None, help="A markdown file to prepend to the start of each created slide deck")
+# Bundling, copies built decks into one folder with only the files they use
 
-    arg_parser.add_argument("-v", "--version", action="version", version="BuildSlides 0.0.0")
-    args = arg_parser.parse_args()
+_COMPRESSIBLE:Final = frozenset({".html", ".css", ".js", ".svg", ".json", ".txt", ".md"})
+_IMAGE_TYPES:Final = {".svg": "image/svg+xml", ".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
+                      ".gif": "image/gif", ".ico": "image/x-icon", ".webp": "image/webp"}
+_NOT_LOCAL:Final = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|//|#)")
+_LINK_TAG:Final = re.compile(r"(?P<indent>[ \t]*)(?P<tag><link\b[^>]*>)(?P<end>[ \t]*\r?\n)?")
+_SCRIPT_TAG:Final = re.compile(r"(?P<indent>[ \t]*)(?P<tag><script\b[^>]*\bsrc=\"(?P<url>[^\"]+)\"[^>]*>\s*</script>)(?P<end>[ \t]*\r?\n)?")
+_STYLE_TAG:Final = re.compile(r"(?P<open><style\b[^>]*>)(?P<css>[\s\S]*?)(?P<close></style>)")
+_FILE_REFERENCE:Final = re.compile(r"(?P<prefix>\b(?:src|href)=\"|!\[[^\]\n]*\]\()(?P<url>[^\"()\s]+)")
+_CSS_REFERENCE:Final = re.compile(
+    r"@import\s+(?:url\(\s*(?P<import_quote>['\"]?)(?P<import_url>[^'\")]+)(?P=import_quote)\s*\)|['\"](?P<import_string>[^'\"]+)['\"])(?P<media>[^;]*);"
+    r"|url\(\s*(?P<quote>['\"]?)(?P<url>[^'\")]+)(?P=quote)\s*\)"
+    r"|@charset\s+['\"][^'\"]*['\"]\s*;"
+)
+_CSS_TOKENS:Final = re.compile(r"(?P<string>\"(?:[^\"\\\n]|\\.)*\"|'(?:[^'\\\n]|\\.)*')|(?P<comment>/\*(?!!)[\s\S]*?\*/)")
+_SOURCE_MAP_COMMENT:Final = re.compile(r"^[ \t]*//[#@] sourceMappingURL=.*$", re.MULTILINE)
+
+def minify_css(css:str) -> str:
+    """
+    Drop comments (bar /*! licences */) and whitespace that does not change what the css means, strings are untouched
+    """
+    def minify_code(code:str) -> str:
+        code = re.sub(r"\s*([{};,>])\s*", r"\1", re.sub(r"\s+", " ", code))
+        # a space before a colon can be a descendant selector, after one it never matters
+        return re.sub(r":\s+", ":", code).replace(";}", "}")
+    output: list[str] = []
+    last_end = 0
+    for token in _CSS_TOKENS.finditer(css):
+        output.append(minify_code(css[last_end:token.start()]))
+        if token.lastgroup == "string": output.append(token.group())
+        last_end = token.end()
+    output.append(minify_code(css[last_end:]))
+    return "".join(output).strip()
+
+@functools.cache
+def _brotli_compress() -> Callable[[bytes], bytes] | None:
+    """brotli is optional, without it only .gz files are written"""
+    try:
+        import brotli # type: ignore[import-not-found]
+    except ImportError:
+        print("brotli is not installed (pip install brotli), only writing .gz files")
+        return None
+    return functools.partial(brotli.compress, quality=11)
+
+def _split_url(url:str) -> tuple[str, str]:
+    """Split a url into its path and its ?query/#fragment"""
+    path = re.split(r"[?#]", url, maxsplit=1)[0]
+    return path, url[len(path):]
+
+class DeckBundler:
+    """
+    Copy decks into destination with only the local files they use. Stylesheets and scripts are concatenated (and
+    css minified) into content addressed files in `assets/` so decks share them, small images are inlined and
+    text files get precompressed .gz (and .br) files beside them.
+    """
+    def __init__(self, destination:str = "deploy", *, inline_limit:int = parse_size("32K")) -> None:
+        self.destination = destination
+        self.inline_limit = inline_limit
+        self.assets: dict[str, str] = {} # source file -> url from assets/ (or data uri)
+        self.remote_imports: list[str] = [] # of the stylesheet being bundled, they have to go first
+
+    def bundle(self, html_files:Iterable[str]) -> list[str]:
+        """
+        Bundle each html file, returns the bundled html files
+        """
+        os.makedirs(os.path.join(self.destination, "assets"), exist_ok=True)
+        return [self.bundle_html(html_file) for html_file in html_files]
 
-    input_files:set[str] = {f for f in args.input_files if os.path.isfile(f) and (f not in args.ignore)}
+    def bundle_html(self, html_file:str) -> str:
+        with open(html_file, encoding="utf-8") as in_file:
+            page = in_file.read()
+        base = os.path.dirname(html_file)
+        page = _FILE_REFERENCE.sub(lambda reference: reference.group("prefix") + self._page_url(reference.group("url"), base), page)
+        page = self._bundle_tags(page, _LINK_TAG, ".css", lambda tag: self._stylesheet(tag, base))
+        page = self._bundle_tags(page, _SCRIPT_TAG, ".js", lambda tag: self._script(tag, base))
+        page = _STYLE_TAG.sub(lambda style: style.group("open") + minify_css(style.group("css")) + style.group("close"), page)
+        output_file = os.path.join(self.destination, os.path.basename(html_file))
+        self._write(output_file, page.encode("utf-8"))
+        return output_file
+
+    def _bundle_tags(self, page:HTML, pattern:re.Pattern[str], suffix:str, read:Callable[[re.Match[str]], str | None]) -> HTML:
+        """
+        Replace every tag pattern finds that read can read with one tag (where the first was) for all of their contents
+        """
+        contents: list[str] = []
+        placeholder = f"@__BUNDLED{suffix.upper()}__@"
+        def collect(tag:re.Match[str]) -> str:
+            content = read(tag)
+            if content is None: return tag.group()
+            contents.append(content)
+            return (tag.group("indent") + placeholder + (tag.group("end") or "")) if len(contents) == 1 else ""
+        self.remote_imports = []
+        page = pattern.sub(collect, page)
+        if not contents: return page
+        if suffix == ".css": bundled = minify_css("\n".join(dict.fromkeys(self.remote_imports)) + "\n".join(contents))
+        else: bundled = ";\n".join(contents)
+        url = "assets/" + self._write_asset(bundled.encode("utf-8"), suffix)
+        tag = f'<link rel="stylesheet" href="{url}">' if suffix == ".css" else f'<script src="{url}"></script>'
+        return page.replace(placeholder, tag)
+
+    def _stylesheet(self, link:re.Match[str], base:str) -> str | None:
+        tag = link.group("tag")
+        href = re.search(r"\bhref=\"([^\"]+)\"", tag)
+        if re.search(r"\brel=\"stylesheet\"", tag) is None or href is None or _NOT_LOCAL.match(href.group(1)): return None
+        path = os.path.join(base, _split_url(href.group(1))[0])
+        return self._read_css(path) if os.path.isfile(path) else None
+
+    def _script(self, script:re.Match[str], base:str) -> str | None:
+        if _NOT_LOCAL.match(script.group("url")): return None
+        path = os.path.join(base, _split_url(script.group("url"))[0])
+        if not os.path.isfile(path): return None
+        with open(path, encoding="utf-8") as script_file:
+            # source maps are not bundled, so do not point browsers at them
+            return _SOURCE_MAP_COMMENT.sub("", script_file.read()).strip()
+
+    def _read_css(self, path:str) -> str:
+        """
+        Read a stylesheet with local imports inlined and the files it uses copied (or inlined) into assets/
+        """
+        with open(path, encoding="utf-8") as css_file:
+            css = css_file.read()
+        base = os.path.dirname(path)
+        def rewrite(reference:re.Match[str]) -> str:
+            import_url = reference.group("import_url") or reference.group("import_string")
+            if import_url is not None:
+                import_path = os.path.join(base, _split_url(import_url)[0])
+                # concatenated files cannot have @import part way through so local ones are inlined
+                if _NOT_LOCAL.match(import_url) or not os.path.isfile(import_path):
+                    self.remote_imports.append(reference.group())
+                    return ""
+                media = reference.group("media").strip()
+                return f"@media {media}{{{self._read_css(import_path)}}}" if media else self._read_css(import_path)
+            if reference.group("url") is None: return "" # @charset is only allowed first
+            path, rest = _split_url(reference.group("url"))
+            if _NOT_LOCAL.match(reference.group("url")) or not os.path.isfile(os.path.join(base, path)): return reference.group()
+            return f"url({self._asset_url(os.path.join(base, path))}{rest})"
+        return _CSS_REFERENCE.sub(rewrite, css)
+
+    def _page_url(self, url:str, base:str) -> str:
+        """Where a page's src/href/markdown image points after bundling, stylesheets, scripts and pages stay put"""
+        path, rest = _split_url(url)
+        if _NOT_LOCAL.match(url) or os.path.splitext(path)[1].lower() in (".html", ".css", ".js") or not os.path.isfile(os.path.join(base, path)): return url
+        asset_url = self._asset_url(os.path.join(base, path))
+        return asset_url if asset_url.startswith("data:") else "assets/" + asset_url + rest
+
+    def _asset_url(self, path:str) -> str:
+        """Copy a file into assets/, images smaller than inline_limit become data uris instead"""
+        path = os.path.normpath(path)
+        if path not in self.assets:
+            with open(path, "rb") as asset_file:
+                content = asset_file.read()
+            suffix = os.path.splitext(path)[1].lower()
+            if suffix == ".svg" and len(content) <= self.inline_limit:
+                # text compresses far better than base64, brackets and spaces are escaped so it is safe in markdown and css
+                self.assets[path] = "data:image/svg+xml," + urllib.parse.quote(content.decode("utf-8"), safe="/:=,;@!$*+")
+            elif suffix in _IMAGE_TYPES and len(content) <= self.inline_limit:
+                self.assets[path] = f"data:{_IMAGE_TYPES[suffix]};base64,{base64.b64encode(content).decode()}"
+            else:
+                self.assets[path] = self._write_asset(content, suffix)
+        return self.assets[path]
+
+    def _write_asset(self, content:bytes, suffix:str) -> str:
+        """Write content to assets/ named after its hash, returns its name"""
+        name = hashlib.sha256(content).hexdigest()[:16] + suffix
+        path = os.path.join(self.destination, "assets", name)
+        if not os.path.exists(path): self._write(path, content)
+        return name
+
+    def _write(self, path:str, content:bytes) -> None:
+        with open(path, "wb") as out_file:
+            out_file.write(content)
+        if os.path.splitext(path)[1].lower() not in _COMPRESSIBLE: return
+        with open(path + ".gz", "wb") as gz_file:
+            gz_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if (compress := _brotli_compress()) is not None:
+            with open(path + ".br", "wb") as br_file:
+                br_file.write(compress(content))
+
+def input_files_of(args:"argparse.Namespace") -> list[str]:
+    # sorted so decks (and their errors) are always processed in the same order
+    return sorted({f for f in args.input_files if os.path.isfile(f) and (f not in args.ignore)})
+
+def build_slides(args:"argparse.Namespace", graph:BuildGraph) -> list[str]:
+    """
+    Build the decks given on the command line that are not up to date, returns the files written
+    """
+    input_files = input_files_of(args)
+    written: list[str] = []
     # If we have an index we might have to write it again (more files) or not (rebuilding some files but not all)
     if not args.no_index:
-        create_contents_index(input_files)
+        if args.rebuild or not graph.index_is_up_to_date(input_files):
+            create_contents_index(input_files)
+            graph.record_index(input_files)
+            written.append("index.html")
 
+    # Everything other than the markdown that changes what a deck becomes
+    settings = (
+        hash_file(__file__), hash_file(args.template), hash_file(args.begin_slide), hash_file(args.end_slide),
+        args.reveal_js_path, args.prerender, dataclasses.astuple(_CPP_LIMITS), _PYTHON_POOL.timeout, _PYTHON_POOL.memory_limit, _PYTHON_POOL.output_limit,
+    )
+    # Find the code of every deck first so it can all be handled together
+    decks: list[Deck] = []
     for input_file in input_files:
         try:
-            output_file = args.output_prefix + clean_link(input_file) + ".html"
-            print(f"Processing {input_file}")
-            markdown_data = create_markdown_data(input_file)
+            meta = create_file_meta(input_file)
+            with _PROFILER.span("read", deck=meta.data["filename"]):
+                markdown_data = read_markdown_file(input_file)
             if markdown_data is None:
                 print(f"Ignored file {input_file}")
                 continue
-            markdown_data = prepend_markdown_file(args.begin_slide, markdown_data)
-            markdown_data = append_markdown_file(args.end_slide, markdown_data)
-            create_html_file(markdown_data, output_file, input_file, template_file_name=args.template, reveal_js_path=args.reveal_js_path)
+            inputs_hash = BuildGraph.inputs_hash(markdown_data, settings)
+            if not args.rebuild and graph.is_up_to_date(args.output_prefix + clean_link(input_file) + ".html", inputs_hash):
+                print(f"Up to date {input_file}")
+                continue
+            print(f"Processing {input_file}")
+            with _PROFILER.span("scan", deck=meta.data["filename"]):
+                blocks = collect_code_blocks(markdown_data, meta)
+            decks.append(Deck(input_file, markdown_data, meta, blocks, inputs_hash))
+        except Exception as e:
+            print(f"Could not process {input_file}")
+            raise e
+
+    with _PROFILER.span("code blocks"):
+        all_results = run_code_blocks((block for deck in decks for block in deck.blocks), jobs=args.jobs)
+
+    results_start = 0
+    for deck in decks:
+        input_file = deck.input_file
+        results = all_results[results_start:results_start + len(deck.blocks)]
+        results_start += len(deck.blocks)
+        try:
+            output_file = args.output_prefix + clean_link(input_file) + ".html"
+            with _PROFILER.span("substitute", deck=deck.meta.data["filename"]):
+                markdown_chunks = substituted_chunks(deck.markdown, deck.blocks, results, deck.meta)
+                markdown_chunks = prepend_markdown_file(args.begin_slide, markdown_chunks)
+                markdown_chunks = append_markdown_file(args.end_slide, markdown_chunks)
+            with _PROFILER.span("output", deck=deck.meta.data["filename"]):
+                create_html_file(markdown_chunks, output_file, input_file, template_file_name=args.template, reveal_js_path=args.reveal_js_path, prerender=args.prerender)
+            graph.record(output_file, deck.inputs_hash, deck.blocks, results)
+            written.append(output_file)
         except Exception as e:
             print(f"Could not process {input_file}")
             raise e
+        finally:
+            # decks built before an error are still up to date next run
+            graph.save()
+
+    graph.save()
+    return written
+
+_LIVE_RELOAD_PATH:Final = "/__rayveal_live_reload"
+_LIVE_RELOAD_SCRIPT:Final = f"""<script>
+new EventSource("{_LIVE_RELOAD_PATH}").onmessage = (event) => {{
+    const page = decodeURIComponent(location.pathname.split("/").pop()) || "index.html";
+    if (JSON.parse(event.data).includes(page)) location.reload();
+}};
+</script>
+"""
+
+class LiveReload:
+    """
+    Lets the served pages know which files were rebuilt
+    """
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._version = 0
+        self._changed: list[str] = []
+
+    def notify(self, changed_files:Iterable[str]) -> None:
+        with self._condition:
+            self._version += 1
+            self._changed = [os.path.basename(file_name) for file_name in changed_files]
+            self._condition.notify_all()
+
+    def wait(self, seen_version:int, timeout:float) -> tuple[int, list[str] | None]:
+        """
+        Wait for a rebuild after seen_version, returns the new version and changed files, or None on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._version != seen_version, timeout): return seen_version, None
+            return self._version, self._changed
+
+    @property
+    def version(self) -> int:
+        with self._condition:
+            return self._version
+
+def serve_with_live_reload(port:int, live_reload:LiveReload) -> "http.server.ThreadingHTTPServer":
+    """
+    Serve this folder in the background, html pages reload themselves when live_reload says they were rebuilt
+    """
+    import http.server
+
+    class LiveReloadHandler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path == _LIVE_RELOAD_PATH: return self._send_events()
+            file_path = self.translate_path(self.path)
+            if os.path.isdir(file_path): file_path = os.path.join(file_path, "index.html")
+            if not file_path.endswith(".html") or not os.path.isfile(file_path): return super().do_GET()
+            with open(file_path, "rb") as html_file:
+                page = html_file.read()
+            before, body_end, after = page.rpartition(b"</body>")
+            page = before + _LIVE_RELOAD_SCRIPT.encode() + body_end + after if body_end else page + _LIVE_RELOAD_SCRIPT.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(page)
+
+        def _send_events(self) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            version = live_reload.version
+            try:
+                while True:
+                    version, changed = live_reload.wait(version, timeout=15)
+                    # a comment when nothing changed finds closed pages
+                    self.wfile.write(b": keep alive\n\n" if changed is None else f"data: {json.dumps(changed)}\n\n".encode())
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+        def log_message(self, format:str, *args:Any) -> None:
+            pass
+
+    server = http.server.ThreadingHTTPServer(("localhost", port), LiveReloadHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def watch(args:"argparse.Namespace", graph:BuildGraph, *, poll_interval:float = 0.2) -> None:
+    """
+    Rebuild whenever an input changes until interrupted, serving the slides with live reload.
+    This process stays alive so the compiler, code results and python workers are ready for each rebuild.
+    """
+    watched = [*args.input_files, args.template, args.begin_slide, args.end_slide]
+    def modified_times() -> dict[str, int | None]:
+        times: dict[str, int | None] = {}
+        for file_name in watched:
+            if file_name is None: continue
+            try:
+                times[file_name] = os.stat(file_name).st_mtime_ns
+            except OSError:
+                times[file_name] = None
+        return times
+
+    live_reload = LiveReload()
+    server = serve_with_live_reload(args.port, live_reload) if args.port > 0 else None
+    if server is not None: print(f"Serving slides on http://localhost:{server.server_address[1]}/")
+    print("Watching for changes, Ctrl+C to stop")
+    # None builds straight away
+    last_times: dict[str, int | None] | None = None
+    try:
+        while True:
+            if (times := modified_times()) == last_times:
+                time.sleep(poll_interval)
+                continue
+            last_times = times
+            start = time.perf_counter()
+            try:
+                written = build_slides(args, graph)
+            except Exception:
+                # keep watching, the next save probably fixes it
+                traceback.print_exc()
+                continue
+            print(f"Rebuilt {', '.join(written) or 'nothing'} in {time.perf_counter() - start:.2f}s")
+            live_reload.notify(written)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None: server.shutdown()
+
+def _add_cache_budget_arguments(arg_parser:"argparse.ArgumentParser") -> None:
+    arg_parser.add_argument("--cache-max-size", type=parse_size, default=parse_size(_DEFAULT_CACHE_MAX_SIZE), help=f"Evict least recently used code results once the cache is bigger than this, accepts K/M/G suffixes. Default is {_DEFAULT_CACHE_MAX_SIZE}")
+    arg_parser.add_argument("--cache-max-age", type=float, default=_DEFAULT_CACHE_MAX_AGE_DAYS, help=f"Evict code results not used for this many days. Default is {_DEFAULT_CACHE_MAX_AGE_DAYS:g}")
+
+def cache_main(argv:list[str]) -> None:
+    import argparse
+    arg_parser = argparse.ArgumentParser(prog="Rayveal.js.py cache", description="Inspect and maintain the compile/run cache in build/cache, or serve a shared one.", add_help=True)
+    sub_parsers = arg_parser.add_subparsers(dest="command", required=True)
+    sub_parsers.add_parser("stats", help="Show how many results are cached and their size")
+    _add_cache_budget_arguments(sub_parsers.add_parser("gc", help="Evict old and least recently used results until within budget"))
+    sub_parsers.add_parser("clear", help="Remove everything in the cache")
+    serve_parser = sub_parsers.add_parser("serve", help="Serve a shared cache over http for builds given --shared-cache http://host:port")
+    serve_parser.add_argument("--directory", type=str, default=_DEFAULT_SHARED_CACHE, help=f"Folder the shared results are kept in. Defaults to {_DEFAULT_SHARED_CACHE}")
+    serve_parser.add_argument("--host", type=str, default="localhost", help="Address to listen on, 0.0.0.0 for every interface. Defaults to localhost")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port to listen on. Defaults to 8765")
+    args = arg_parser.parse_args(argv)
+
+    match args.command:
+        case "stats":
+            stats = _RESULT_CACHE.stats()
+            def age(timestamp:float|None) -> str:
+                return "n/a" if timestamp is None else f"{(time.time() - timestamp) / 86400:.1f} days ago"
+            print(f"Cache directory: {_RESULT_CACHE.directory}\n"
+                  f"Entries:         {stats.entries}\n"
+                  f"Size:            {stats.size / 1024**2:.2f} MiB\n"
+                  f"Oldest access:   {age(stats.oldest_access)}\n"
+                  f"Newest access:   {age(stats.newest_access)}")
+        case "gc":
+            evicted = _RESULT_CACHE.gc(max_size=args.cache_max_size, max_age=args.cache_max_age * 86400)
+            print(f"Evicted {evicted} cached results")
+        case "clear":
+            _RESULT_CACHE.clear()
+            print(f"Cleared {_RESULT_CACHE.directory}")
+        case "serve":
+            server = serve_result_store(DirectoryResultStore(args.directory), args.port, host=args.host)
+            print(f"Serving results in {args.directory} on http://{args.host}:{server.server_address[1]}/, Ctrl+C to stop")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+def main() -> None:
+    import argparse
+    # `rayveal.py cache <command>` maintains the cache instead of building slides
+    if len(sys.argv) > 1 and sys.argv[1] == "cache": return cache_main(sys.argv[2:])
+    arg_parser = argparse.ArgumentParser(prog="Rayveal.js.py", description="Create slides from markdown file with code blocks that can be compiled and executed.", add_help=True)
+    arg_parser.add_argument("input_files", metavar="input_markdown_files", type=str, nargs="+", help="markdown files to process, wildcards are allowed")
+    arg_parser.add_argument("-t", "--template", type=str, default=None, help=f"Specify the template file to use. Default is TemplateSlides.html.in, or {_PRERENDER_TEMPLATE} with --prerender")
+    arg_parser.add_argument("-o", "--output-prefix", type=str, default="", help="Specify the output folder name.\n Default is this folder")
+    arg_parser.add_argument("-r", "--reveal-js-path", type=str, default=None, help="Path to reveal.js folder.\n Defaults to cloning the reveal.js repo in build/reveal_js.")
+    arg_parser.add_argument("-i", "--ignore", type=str, default="", help="glob pattern of files to ignore, useful for READMEs, defaults to nothing")
+    arg_parser.add_argument("-n", "--no-index", action="store_true", help="If a contents index should be (re/)created, defaults to creating one")
+    arg_parser.add_argument("-e", "--end-slide", type=str, default=None, help="A markdown file to append to the end of each created slide deck, useful for contact info etc.")
+    arg_parser.add_argument("-b", "--begin-slide", type=str, default=None, help="A markdown file to prepend to the start of each created slide deck")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1, help="How many code blocks to compile/run at once, 0 uses every core. Defaults to 1")
+    arg_parser.add_argument("--python-timeout", type=float, default=30.0, help="Seconds a python block may run for before it is stopped, 0 for no limit. Defaults to 30")
+    arg_parser.add_argument("--python-memory", type=parse_size, default=parse_size("512M"), help="Memory each python block may use, accepts K/M/G suffixes, 0 for no limit. Defaults to 512M")
+    arg_parser.add_argument("--python-output", type=parse_size, default=parse_size("64K"), help="Characters a python block may print before the rest is dropped, accepts K/M/G suffixes, 0 for no limit. Defaults to 64K")
+    arg_parser.add_argument("--python-max-tasks", type=int, default=25, help="Python blocks a worker process runs before it is replaced with a fresh one. Defaults to 25")
+    arg_parser.add_argument("--cpp-timeout", type=float, default=10.0, help="Seconds (wall clock and CPU) a compiled C++ block may run for, 0 for no limit. Defaults to 10")
+    arg_parser.add_argument("--cpp-memory", type=parse_size, default=parse_size("1G"), help="Address space a compiled C++ block may use, accepts K/M/G suffixes, 0 for no limit. Defaults to 1G")
+    arg_parser.add_argument("--cpp-output", type=parse_size, default=parse_size("64K"), help="Output kept from each of stdout and stderr of a C++ block, accepts K/M/G suffixes, 0 for no limit. Defaults to 64K")
+    arg_parser.add_argument("--cpp-batch", type=int, default=8, help="C++ blocks that are never ran (no main or compile only) compiled per compiler run, 1 compiles each alone. Defaults to 8")
+    arg_parser.add_argument("-p", "--prerender", action="store_true", help="Render the markdown and highlight code when building, so browsers are sent finished slides")
+    arg_parser.add_argument("--bundle", type=str, default=None, metavar="FOLDER", help="After building, copy the decks into FOLDER with only the reveal.js files they use, bundled, minified and precompressed")
+    arg_parser.add_argument("--inline-limit", type=parse_size, default=parse_size("32K"), help="Images up to this size are inlined into bundled decks, accepts K/M/G suffixes, 0 to never inline. Defaults to 32K")
+    arg_parser.add_argument("-w", "--watch", action="store_true", help="Keep running, rebuild when an input changes and serve the slides with live reload")
+    arg_parser.add_argument("--port", type=int, default=8000, help="Port to serve slides on while watching, 0 to not serve. Defaults to 8000")
+    arg_parser.add_argument("--profile", action="store_true", help="Time each part of the build, deck and code block, print the slowest and write them all to --profile-file as a Chrome trace")
+    arg_parser.add_argument("--profile-file", type=str, default=_DEFAULT_PROFILE, metavar="FILE", help=f"Where --profile writes its trace. Defaults to {_DEFAULT_PROFILE}")
+    arg_parser.add_argument("--shared-cache", type=str, default=None, metavar="LOCATION", help="Also get and put code results in a shared cache, a folder (e.g. on a network drive) or an http url (see `cache serve`)")
+    arg_parser.add_argument("--rebuild", action="store_true", help="Build every deck, even those whose inputs have not changed since they were last built")
+    _add_cache_budget_arguments(arg_parser)
+
+    arg_parser.add_argument("-v", "--version", action="version", version="BuildSlides 0.0.0")
+    args = arg_parser.parse_args()
+    inputs = {os.path.realpath(input_file) for input_file in args.input_files + [args.template, args.begin_slide, args.end_slide] if input_file is not None}
+    if args.profile and os.path.realpath(args.profile_file) in inputs: arg_parser.error(f"--profile-file {args.profile_file} is an input, the trace would be written over it")
+    if args.jobs <= 0: args.jobs = os.cpu_count() or 1
+    if args.template is None: args.template = _PRERENDER_TEMPLATE if args.prerender else "TemplateSlides.html.in"
+    _PYTHON_POOL.workers = args.jobs
+    _PYTHON_POOL.timeout = args.python_timeout if args.python_timeout > 0 else None
+    _PYTHON_POOL.memory_limit = args.python_memory if args.python_memory > 0 and os.name == "posix" else None
+    _PYTHON_POOL.output_limit = args.python_output if args.python_output > 0 else None
+    _PYTHON_POOL.max_tasks = max(args.python_max_tasks, 1)
+    _CPP_LIMITS.timeout = args.cpp_timeout if args.cpp_timeout > 0 else None
+    _CPP_LIMITS.cpu = math.ceil(args.cpp_timeout) if args.cpp_timeout > 0 else None
+    _CPP_LIMITS.memory = args.cpp_memory if args.cpp_memory > 0 else None
+    _CPP_LIMITS.output = args.cpp_output if args.cpp_output > 0 else None
+    _CPP_BATCHER.size = args.cpp_batch
+    if args.shared_cache is not None: _RESULT_CACHE.shared = create_result_store(args.shared_cache)
+
+    graph = BuildGraph()
+    # a watch keeps building, so has no end to report at
+    _PROFILER.enabled = args.profile and not args.watch
+    if args.watch: watch(args, graph)
+    else: build_slides(args, graph)
+    if args.bundle is not None and not args.watch:
+        outputs = [args.output_prefix + clean_link(input_file) + ".html" for input_file in input_files_of(args)]
+        if not args.no_index: outputs.append("index.html")
+        with _PROFILER.span("bundle"):
+            DeckBundler(args.bundle, inline_limit=args.inline_limit).bundle(output for output in outputs if os.path.isfile(output))
+    if _PROFILER.enabled: _PROFILER.report(args.profile_file)
+    _RESULT_CACHE.gc(max_size=args.cache_max_size, max_age=args.cache_max_age * 86400)
 
 if __name__ == "__main__":
     main()
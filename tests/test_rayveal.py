@@ -0,0 +1,62 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rayveal
+
+class RenderMarkdownTest(unittest.TestCase):
+    def test_ordered_list_items_are_siblings(self) -> None:
+        self.assertEqual(rayveal.render_markdown("1. first\n2. second\n3. third"),
+                         "<ol>\n<li>first</li>\n<li>second</li>\n<li>third</li>\n</ol>\n")
+
+class CppBatchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.working_directory = os.getcwd()
+        os.chdir(self.directory.name)
+        rayveal._RESULT_CACHE.clear()
+
+    def tearDown(self) -> None:
+        rayveal._RESULT_CACHE.clear()
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    @unittest.skipIf(shutil.which("g++") is None and shutil.which("clang++") is None, "needs a C++ compiler")
+    def test_same_block_in_two_decks_is_compiled_once(self) -> None:
+        deck = "```C++\nint one = 1;\n```\n<!-- .element: wants=\"compiles\" -->\n\n```C++\nint two = 2;\n```\n<!-- .element: wants=\"compiles\" -->\n"
+        blocks = [block for name in ("first.md", "second.md") for block in rayveal.collect_code_blocks(deck, rayveal.MetaData({"filename": name}))]
+        compiles: list[tuple[str, ...]] = []
+        run = subprocess.run
+        def counting_run(args:tuple[str, ...], *rest:object, **kwargs:object) -> subprocess.CompletedProcess[bytes]:
+            if "-fsyntax-only" in args: compiles.append(tuple(args))
+            return run(args, *rest, **kwargs)
+        with mock.patch.object(rayveal.subprocess, "run", counting_run):
+            results = rayveal.run_code_blocks(blocks, jobs=4)
+        self.assertTrue(all(result.compiles for result in results))
+        self.assertEqual(len(compiles), 1)
+
+class PythonWorkerPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = rayveal.PythonWorkerPool()
+        self.addCleanup(self.pool.close)
+
+    def test_sys_exit_0_runs(self) -> None:
+        result = self.pool.run("import sys\nprint('before')\nsys.exit(0)\nprint('after')")
+        self.assertTrue(result.runs)
+        assert result.run_result is not None
+        self.assertEqual(result.run_result.run_output, "before\n")
+
+    def test_sys_exit_3_is_the_return_code(self) -> None:
+        result = self.pool.run("import sys\nsys.exit(3)")
+        assert result.run_result is not None
+        self.assertEqual(result.run_result.return_code, 3)
+        # the worker survives, so the next block still runs
+        self.assertTrue(self.pool.run("print('next')").runs)
+
+if __name__ == "__main__":
+    unittest.main()